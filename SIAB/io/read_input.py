@@ -336,6 +336,7 @@ def siab_settings(user_settings: dict, minimal_basis: list, z_val: float = 0):
         "spill_coefs": user_settings.get("spill_coefs", [2.0, 1.0]),
         "spill_thr": user_settings.get("spill_thr", 1e-8),
         "nthreads_rcut": user_settings.get("nthreads_rcut", -1),
+        "nprocs_rcut": user_settings.get("nprocs_rcut", 1),
         "orbitals": [{} for _ in range(len(user_settings["orbitals"]))],
         "jY_type": user_settings.get("jY_type", "reduced")
     }
@@ -1224,6 +1225,7 @@ STRU4       trimer      18      2       1      2.6 3.2 3.8
             'jY_type': 'reduced',
             'optimizer': 'pytorch.SWAT', 
             'nthreads_rcut': -1,
+            'nprocs_rcut': 1,
             'max_steps': 200, 
             'spill_coefs': [2.0, 1.0], 
             'spill_thr': 1e-08,
@@ -7,13 +7,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 from SIAB.spillage.orbio import read_param, write_nao, write_param
 from SIAB.spillage.spillage import Spillage_jy, Spillage_pw, flatten,\
-    initgen_jy, initgen_pw
+    initgen_jy, initgen_pw, MonomerRef, _blas_nthreads, _spawn_pool, _limit_blas
 from SIAB.spillage.listmanip import merge
 from SIAB.spillage.plot import plot_chi
 from SIAB.spillage.radial import coeff_normalized2raw, coeff_reduced2raw,\
     build_raw, build_reduced, _nbes
 from SIAB.spillage.datparse import read_wfc_lcao_txt, read_triu, \
-    read_running_scf_log, read_input_script, read_orb_mat
+    read_running_scf_log, read_input_script, read_orb_mat_header
 from SIAB.spillage.lcao_wfc_analysis import _wll
 import unittest
 
@@ -129,7 +129,8 @@ def _coef_opt_jy(rcut, orbparams, folders, options, nthreads, spill_coefs = None
         iconfs[iorb] = [configs.index(folder) for f in orb['folder'] for folder in folders[f]]
     
     for folder in configs:
-        minimizer.config_add(os.path.join(folder, f"OUT.{os.path.basename(folder)}"))
+        minimizer.config_add(os.path.join(folder, f"OUT.{os.path.basename(folder)}"),
+                             nthreads=nthreads)
     
 
     # infer nzeta if `zeta_notation` specified as `auto`, this cause the `nzeta` to be `auto`
@@ -200,7 +201,9 @@ def _coef_opt_pw(rcut, orbparams, folders, options, nthreads, spill_coefs = None
     fov = None
     for folder in configs:
         for fov_, fop_ in _orb_matrices(folder):
-            ov, op = map(read_orb_mat, [fov_, fop_])
+            # only headers are read to select the files, matrices of the
+            # matched pair are parsed (once) by config_add
+            ov, op = map(read_orb_mat_header, [fov_, fop_])
             assert ov['rcut'] == op['rcut'], "Data violation: rcut of ov and op matrices are different"
             if np.abs(ov['rcut'] - rcut) < 1e-10:
                 print(f"ORBGEN: jy_jy, mo_jy and mo_mo matrices loaded from {fov_} and {fop_}", flush = True)
@@ -564,8 +567,71 @@ def _build_orb(coefs, rcut, dr: float = 0.01, jY_type: str = "reduced"):
         chi = build_raw(coefs[0], rcut, r, 0.0, True, True)
     return chi
 
+def _coef_rcut(rcut, ecut, siab_settings, folders, run_type):
+    """generate the coefficients of orbitals of all levels for one rcut value.
+    Calculations of different rcut values are independent of each other.
+
+    Parameters
+    ----------
+    rcut: float
+        the cutoff radius
+    ecut: float
+        the energy cutoff
+    siab_settings: dict
+        the settings for SIAB optimization
+    folders: list
+        the folders where the ABACUS run information are stored
+    run_type: str
+        can be "opt", "restart" or "none"
+
+    Returns
+    -------
+    list[list[list[list[float]]]]: the coefficients of the orbitals of each level
+    """
+    # for jy basis calculation, only matched rcut folders are needed
+    if run_type == "opt":
+        # REFACTOR: SIAB-v3.0, get folders with matched rcut
+        f_ = [[f for f in fgrp if len(f.split("-")) == 3 or \
+               float(f.split("-")[-1].replace("au", "")) == rcut] # jy case 
+              for fgrp in folders]
+        jy = [f for f in folders if len(f) > 0][0][0][-2:] == "au"
+        return _coef_opt(rcut, 
+                         siab_settings['orbitals'],
+                         f_, 
+                         siab_settings.get("max_steps", 2000),
+                         siab_settings.get("nthreads", 4),
+                         jy,
+                         siab_settings.get("spill_coefs", None))
+    elif run_type == "restart":
+        raise NotImplementedError("restart is not implemented yet")
+    else: # run_type == "none", used to generate jY basis
+        return [_coef_gen(rcut, ecut, len(orb['nzeta']) - 1) for orb in siab_settings['orbitals']]
+
+def _nworkers_rcut(nprocs_rcut, nrcuts):
+    """the number of rcut values to optimize concurrently. A value of `nprocs_rcut`
+    less than 2 means rcuts are run in serial.
+    
+    Parameters
+    ----------
+    nprocs_rcut: int
+        the number of processes requested for optimizing rcut values concurrently
+    nrcuts: int
+        the number of rcut values
+    
+    Returns
+    -------
+    int: the number of rcut workers, 1 for serial run
+    """
+    return max(1, min(nprocs_rcut, nrcuts))
+
 def iter(siab_settings: dict, calculation_settings: list, folders: list):
     """Loop over rcut values and yield orbitals
+
+    If siab_settings["nprocs_rcut"] is larger than 1, the rcut values are optimized
+    concurrently by a pool of (at most) nprocs_rcut processes, each of which takes
+    one rcut at a time and runs BLAS with its share of the available cores. By
+    default rcuts are run in serial. Orbitals are saved in the order of rcuts in
+    either case.
     
     Parameters
     ----------
@@ -587,33 +653,31 @@ def iter(siab_settings: dict, calculation_settings: list, folders: list):
 
     run_map = {"none": "none", "restart": "restart", "bfgs": "opt"}
     run_type = run_map.get(siab_settings.get("optimizer", "none"), "none")
-    for rcut in rcuts: # can be parallelized here
-
-        ##############
-        # Generation #
-        ##############
-        # for jy basis calculation, only matched rcut folders are needed
-        if run_type == "opt":
-            # REFACTOR: SIAB-v3.0, get folders with matched rcut
-            f_ = [[f for f in fgrp if len(f.split("-")) == 3 or \
-                   float(f.split("-")[-1].replace("au", "")) == rcut] # jy case 
-                  for fgrp in folders]
-            jy = [f for f in folders if len(f) > 0][0][0][-2:] == "au"
-            coefs_tot = _coef_opt(rcut, 
-                                  siab_settings['orbitals'],
-                                  f_, 
-                                  siab_settings.get("max_steps", 2000),
-                                  siab_settings.get("nthreads", 4),
-                                  jy,
-                                  siab_settings.get("spill_coefs", None))
-        elif run_type == "restart":
-            raise NotImplementedError("restart is not implemented yet")
-        else: # run_type == "none", used to generate jY basis
-            coefs_tot = [_coef_gen(rcut, ecut, len(orb['nzeta']) - 1) for orb in siab_settings['orbitals']]
-
-        #################
-        # save orbitals #
-        #################
+
+    ##############
+    # Generation #
+    ##############
+    args = [(rcut, ecut, siab_settings, folders, run_type) for rcut in rcuts]
+    nprocs_rcut = siab_settings.get("nprocs_rcut", 1)
+    nworkers = _nworkers_rcut(nprocs_rcut, len(rcuts)) if run_type == "opt" else 1
+    if nworkers > 1:
+        blas_nthreads = _blas_nthreads(nworkers)
+        print(f"ORBGEN: optimizing {len(rcuts)} rcut values with {nworkers} processes, "
+              f"{blas_nthreads} BLAS thread(s) each", flush = True)
+        pool = _spawn_pool(nworkers, blas_nthreads, _limit_blas, (blas_nthreads,))
+        try:
+            # one rcut per task, results are returned in the order of rcuts
+            coefs_rcut = pool.starmap(_coef_rcut, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        coefs_rcut = (_coef_rcut(*arg) for arg in args) # generated along with saving
+
+    #################
+    # save orbitals #
+    #################
+    for rcut, coefs_tot in zip(rcuts, coefs_rcut):
         for ilev, coefs in enumerate(coefs_tot): # loop over different levels...
             folder = "_".join([elem, f"{rcut}au", f"{ecut}Ry"]) # because the concept of "level" is not clear
             for coefs_it in coefs: # loop over different atom types
@@ -764,36 +828,15 @@ def _nzeta_analysis(folder, count_thr = 1e-1, itype = 0):
     params = read_input_script(os.path.join(folder, "INPUT"))
     outdir = os.path.abspath(os.path.join(folder, "OUT." + params.get("suffix", "ABACUS")))
     nspin = int(params.get("nspin", 1))
-    fwfc = "WFC_NAO_GAMMA" if params.get("gamma_only", False) else "WFC_NAO_K"
-    running = read_running_scf_log(os.path.join(outdir,
-                                                f"running_{params.get('calculation', 'scf')}.log"))
-    
-    assert nspin == running["nspin"], \
-        f"nspin in INPUT and running_scf.log are different: {nspin} and {running['nspin']}"
-    
-    lmaxmax = len(running["nzeta"][itype]) - 1
-    assert lmaxmax >= 0, f"lmaxmax should be at least 0: {lmaxmax}"
-    out = [[[] for _ in range(lmaxmax + 1)] for _ in range(nspin)]
-
-    # if nspin == 2, the "spin-up" kpoints will be listed first, then "spin-down"
-    wk = running["wk"]
-    for isk in range(nspin*len(wk)): 
-        # loop over (ispin, ik), but usually initial guess is a gamma point calculation
-        # so the following w is not used
-        # w = wk[isk % len(wk)]
+    gamma_only = params.get("gamma_only", "0").lower() in ["1", "true", ".true."]
 
-        wfc, _, _, _ = read_wfc_lcao_txt(os.path.join(outdir, f"{fwfc}{isk+1}.txt"))
-        # the complete return list is (wfc.T, e, occ, k)
-        ovlp = read_triu(os.path.join(outdir, f"data-{isk}-S"))
+    # the monomer data (wave functions and overlaps) is loaded once and shared
+    # with the initial guess generation (initgen_jy) of all levels
+    monomer = MonomerRef.load_jy(outdir, params.get("calculation", "scf"), gamma_only)
+    assert nspin == monomer.jy_data["nspin"], \
+        f"nspin in INPUT and running_scf.log are different: {nspin} and {monomer.jy_data['nspin']}"
 
-        wll = _wll(wfc, ovlp, running["natom"], running["nzeta"])
-
-        for ib, wb in enumerate(wll): # loop over bands
-            wlb = np.sum(wb.real, 1) # sum over one dimension, get dim 1 x lmax matrix
-            for l, wl in enumerate(wlb):
-                if wl >= count_thr:
-                    out[isk % len(wk)][l].append(ib)
-    return out
+    return monomer.band_analysis(count_thr, itype)
 
 class TestAPI(unittest.TestCase):
 
@@ -810,6 +853,21 @@ class TestAPI(unittest.TestCase):
             dim2 = len(coefs[0][l][0])
             self.assertEqual(dim1, dim2)
             self.assertEqual(coefs[0][l], np.eye(dim1).tolist())
+
+    def test_nworkers_rcut(self):
+
+        self.assertEqual(_nworkers_rcut(-1, 5), 1)
+        self.assertEqual(_nworkers_rcut(0, 5), 1)
+        self.assertEqual(_nworkers_rcut(1, 5), 1)
+        self.assertEqual(_nworkers_rcut(4, 5), 4)
+        self.assertEqual(_nworkers_rcut(8, 5), 5)
+
+    def test_coef_rcut(self):
+
+        siab_settings = {"orbitals": [{"nzeta": [1, 1]}, {"nzeta": [2, 2, 1]}]}
+        coefs_tot = _coef_rcut(6.0, 60.0, siab_settings, [], "none")
+        self.assertEqual(len(coefs_tot), 2) # one per level
+        self.assertEqual(coefs_tot[1], _coef_gen(6.0, 60.0, 2))
     
     def test_band_indexing(self):
 
@@ -2,6 +2,136 @@ from SIAB.spillage.index import _lin2comp, _nao
 
 import numpy as np
 from scipy.linalg import block_diag
+from copy import copy
+
+class FlatCoef:
+    '''
+    Coefficients coef[itype][l][zeta][q] stored in a flat float64 array.
+
+    The offset of each (itype, l, zeta) in the flat array is precomputed,
+    so that the coefficient matrix of an (itype, l) block can be retrieved
+    by slicing, and a container of the same structure (e.g., a gradient
+    or a trial point of an optimizer) can be made from a flat array
+    without round-tripping through nested lists.
+
+    Attributes
+    ----------
+        data : ndarray of shape (n,)
+            The flattened coefficients in the order of flatten(coef).
+        ncoef : nested list of int
+            ncoef[itype][l][zeta] is len(coef[itype][l][zeta]).
+
+    '''
+    def __init__(self, coef):
+        if isinstance(coef, FlatCoef):
+            self.ncoef = coef.ncoef
+            self._offset = coef._offset
+            self.data = coef.data.copy()
+            return
+
+        self.ncoef = [[[len(coef_tlz) for coef_tlz in coef_tl]
+                       for coef_tl in coef_t] for coef_t in coef]
+
+        # self._offset[itype][l] is the offset of coef[itype][l][0]
+        self._offset = []
+        offset = 0
+        for ncoef_t in self.ncoef:
+            self._offset.append([])
+            for ncoef_tl in ncoef_t:
+                self._offset[-1].append(offset)
+                offset += sum(ncoef_tl)
+
+        self.data = np.array([c for coef_t in coef for coef_tl in coef_t
+                              for coef_tlz in coef_tl for c in coef_tlz],
+                             dtype=float)
+
+
+    def like(self, data):
+        '''
+        A container of the same structure with the given flat data
+        (not copied).
+
+        '''
+        out = object.__new__(FlatCoef)
+        out.ncoef = self.ncoef
+        out._offset = self._offset
+        out.data = np.asarray(data, dtype=float)
+        assert out.data.shape == self.data.shape
+        return out
+
+
+    def block(self, itype, l, nrow=None):
+        '''
+        Coefficient matrix of (itype, l) of shape (nrow, nzeta) whose
+        column zeta is coef[itype][l][zeta], zero-padded to nrow (which
+        defaults to the maximum length over zeta).
+
+        '''
+        ncoef_tl = self.ncoef[itype][l]
+        nq = max(ncoef_tl, default=0)
+        nrow = nq if nrow is None else nrow
+        assert nrow >= nq
+
+        start = self._offset[itype][l]
+        C = np.zeros((nrow, len(ncoef_tl)))
+        if all(n == nq for n in ncoef_tl):
+            C[:nq] = self.data[start:start+nq*len(ncoef_tl)] \
+                    .reshape(len(ncoef_tl), nq).T
+        else:
+            for iz, n in enumerate(ncoef_tl):
+                C[:n, iz] = self.data[start:start+n]
+                start += n
+        return C
+
+
+    def set_block(self, itype, l, C):
+        '''
+        Inverse of block: overwrites coef[itype][l][zeta] with the first
+        len(coef[itype][l][zeta]) elements of C[:, zeta].
+
+        '''
+        start = self._offset[itype][l]
+        for iz, n in enumerate(self.ncoef[itype][l]):
+            self.data[start:start+n] = C[:n, iz]
+            start += n
+
+
+    def tolist(self):
+        '''
+        Nested-list coef[itype][l][zeta][q].
+
+        '''
+        data = self.data.tolist()
+        coef = []
+        for ncoef_t, offset_t in zip(self.ncoef, self._offset):
+            coef.append([])
+            for ncoef_tl, start in zip(ncoef_t, offset_t):
+                coef[-1].append([])
+                for n in ncoef_tl:
+                    coef[-1][-1].append(data[start:start+n])
+                    start += n
+        return coef
+
+
+def _jy2ao_check(ncoef, natom, nbes):
+    '''
+    Sanity checks for the arguments of jy2ao, where ncoef[itype][l][zeta]
+    is len(coef[itype][l][zeta]).
+
+    '''
+    # some sanity checks
+    # 1. the length of natom, nbes & coef should all agree (ntype)
+    assert len(natom) == len(nbes) == len(ncoef)
+
+    # 2. len(coef[itype]) (number of l) should not exceed len(nbes[itype]).
+    assert all(len(ncoef_t) <= len(nbes_t)
+               for nbes_t, ncoef_t in zip(nbes, ncoef))
+
+    # 3. len(coef[itype][l][zeta]) should not exceed nbes[itype][l].
+    assert all(all(all(ncoef_tlz <= nbes_tl for ncoef_tlz in ncoef_tl)
+                   for nbes_tl, ncoef_tl in zip(nbes_t, ncoef_t))
+               for nbes_t, ncoef_t in zip(nbes, ncoef))
+
 
 def jy2ao(coef, natom, nbes):
     '''
@@ -19,7 +149,7 @@ def jy2ao(coef, natom, nbes):
 
     Parameters
     ----------
-        coef : nested list
+        coef : nested list or FlatCoef
             The coefficients of radial functions of pseudo-atomic orbitals
             in terms of the spherical wave (jy) radial functions.
             coef[itype][l][zeta][q] -> float
@@ -42,35 +172,199 @@ def jy2ao(coef, natom, nbes):
     If it is less, the remaining elements are assumed to be zero.
 
     '''
-    # some sanity checks
-    # 1. the length of natom, nbes & coef should all agree (ntype)
-    assert len(natom) == len(nbes) == len(coef)
-
-    # 2. len(coef[itype]) (number of l) should not exceed len(nbes[itype]).
-    assert all(len(coef_t) <= len(nbes_t)
-               for nbes_t, coef_t in zip(nbes, coef))
-
-    # 3. len(coef[itype][l][zeta]) should not exceed nbes[itype][l].
-    assert all(all(all(len(coef_tlz) <= nbes_tl for coef_tlz in coef_tl)
-                   for nbes_tl, coef_tl in zip(nbes_t, coef_t))
-               for nbes_t, coef_t in zip(nbes, coef))
+    coef = coef if isinstance(coef, FlatCoef) else FlatCoef(coef)
+    _jy2ao_check(coef.ncoef, natom, nbes)
 
     def _gen_q2zeta(coef, natom, nbes):
         lmax = [len(nbes_t) - 1 for nbes_t in nbes]
         for itype, _, l, _ in _lin2comp(natom, lmax=lmax):
-            if l >= len(coef[itype]) or len(coef[itype][l]) == 0:
+            if l >= len(coef.ncoef[itype]):
                 # The generator should yield a zero matrix with the
                 # appropriate size when no coefficient is provided.
                 yield np.zeros((nbes[itype][l], 0))
             else:
-                # zero-padding the coefficient to nbes[itype][l]
-                C = np.zeros((nbes[itype][l], len(coef[itype][l])))
-                C[:len(coef[itype][l][0])] = np.array(coef[itype][l]).T
-                yield C
+                # zero-padded to nbes[itype][l]
+                yield coef.block(itype, l, nbes[itype][l])
 
     return block_diag(*_gen_q2zeta(coef, natom, nbes))
 
 
+class BlockJy2ao:
+    '''
+    Block-structured counterpart of jy2ao(coef, natom, nbes).
+
+    The jy-to-ao transformation matrix is extremely sparse: it has one
+    small (q -> zeta) block per (itype, iatom, l, mm), and the block only
+    depends on (itype, l). Instead of a dense matrix, this class keeps one
+    coefficient block per (itype, l) and evaluates matrix products with
+    batched matmuls over atoms and m. It supports
+
+            X @ op      X : ndarray of shape (..., nrow)
+            op @ Y      Y : ndarray of shape (..., ncol, n)
+            op.T
+
+    where (nrow, ncol) = op.shape. Products return dense ndarrays, so an
+    instance can be used in place of jy2ao(coef, natom, nbes) in matrix
+    products with stacked (e.g., k-point-resolved) arrays.
+
+    '''
+    # makes ndarray.__matmul__ defer to BlockJy2ao.__rmatmul__
+    __array_ufunc__ = None
+
+    def __init__(self, coef, natom, nbes):
+        # coef_grad returns the gradient in the same form as coef
+        self._nested = not isinstance(coef, FlatCoef)
+        self._coef = FlatCoef(coef) if self._nested else coef
+        ncoef = self._coef.ncoef
+        _jy2ao_check(ncoef, natom, nbes)
+
+        self._transposed = False
+
+        # Each element of self._blocks describes the (itype, l) block:
+        #
+        # (itype, l, jy_start, jy_stride, jy_lstart,
+        #  ao_start, ao_stride, ao_lstart, natom, nm, C)
+        #
+        # where jy_start (ao_start) is the index of the first jy (ao) of
+        # the type, jy_stride (ao_stride) is the number of jy (ao) per atom
+        # of the type, jy_lstart (ao_lstart) is the offset of l within an
+        # atom, nm = 2*l+1 and C is the zero-padded coefficient matrix of
+        # shape (nbes[itype][l], nzeta).
+        self._blocks = []
+        jy_start = 0
+        ao_start = 0
+        for itype, nbes_t in enumerate(nbes):
+            nzeta_t = [len(ncoef[itype][l]) if l < len(ncoef[itype]) else 0
+                       for l in range(len(nbes_t))]
+            jy_stride = sum((2*l+1) * n for l, n in enumerate(nbes_t))
+            ao_stride = sum((2*l+1) * n for l, n in enumerate(nzeta_t))
+
+            jy_lstart = 0
+            ao_lstart = 0
+            for l, (nbes_tl, nzeta_tl) in enumerate(zip(nbes_t, nzeta_t)):
+                if nzeta_tl > 0:
+                    C = self._coef.block(itype, l, nbes_tl)
+                    self._blocks.append((itype, l,
+                                         jy_start, jy_stride, jy_lstart,
+                                         ao_start, ao_stride, ao_lstart,
+                                         natom[itype], 2*l+1, C))
+                jy_lstart += (2*l+1) * nbes_tl
+                ao_lstart += (2*l+1) * nzeta_tl
+
+            jy_start += natom[itype] * jy_stride
+            ao_start += natom[itype] * ao_stride
+
+        self._shape = (jy_start, ao_start)
+
+
+    @property
+    def shape(self):
+        return self._shape[::-1] if self._transposed else self._shape
+
+
+    @property
+    def T(self):
+        op = copy(self)
+        op._transposed = not self._transposed
+        return op
+
+
+    def toarray(self):
+        return self.__rmatmul__(np.eye(self.shape[0]))
+
+
+    def __rmatmul__(self, X):
+        '''
+        X @ op
+
+        '''
+        X = np.asarray(X)
+        assert X.shape[-1] == self.shape[0]
+
+        # single-precision X is multiplied in single precision
+        out = np.zeros(X.shape[:-1] + (self.shape[1],),
+                       dtype=np.result_type(X.dtype, np.float32))
+        cdtype = np.finfo(out.dtype).dtype
+
+        for (_, _, jy_start, jy_stride, jy_lstart,
+             ao_start, ao_stride, ao_lstart, nat, nm, C) in self._blocks:
+            nbes, nzeta = C.shape
+            jy = _block_view(X if not self._transposed else out, jy_start,
+                             jy_stride, jy_lstart, nat, nm, nbes)
+            ao = _block_view(out if not self._transposed else X, ao_start,
+                             ao_stride, ao_lstart, nat, nm, nzeta)
+            C = C.astype(cdtype, copy=False)
+            if self._transposed:
+                jy[...] = ao @ C.T
+            else:
+                ao[...] = jy @ C
+
+        return out
+
+
+    def __matmul__(self, Y):
+        '''
+        op @ Y
+
+        '''
+        return (np.swapaxes(Y, -1, -2) @ self.T).swapaxes(-1, -2)
+
+
+    def coef_grad(self, terms):
+        '''
+        Gradient w.r.t. coef of a real function f whose gradient w.r.t. the
+        elements of the (untransposed) transformation matrix is
+
+                G = Re sum_{(A, B) in terms} sum_{...} A[...] @ B[...]
+
+        where A has a shape of (..., nrow, n), B has a shape of (..., n,
+        ncol) and the sum runs over all their leading dimensions.
+
+        Each coefficient coef[itype][l][zeta][q] appears in the block of
+        every atom of type `itype` and every m of angular momentum l, so
+        only the diagonal blocks of A @ B are needed. They are contracted
+        once per (itype, l) over atoms, m and all leading dimensions
+        without evaluating the full (nrow, ncol) matrix G.
+
+        Returns
+        -------
+            A nested list with the same structure as coef, or a FlatCoef
+            if the instance was constructed from a FlatCoef.
+
+        '''
+        assert not self._transposed
+
+        grad = self._coef.like(np.zeros_like(self._coef.data))
+
+        for (itype, l, jy_start, jy_stride, jy_lstart,
+             ao_start, ao_stride, ao_lstart, nat, nm, C) in self._blocks:
+            nbes, nzeta = C.shape
+            g = sum(
+                np.tensordot(
+                    _block_view(np.swapaxes(A, -1, -2), jy_start, jy_stride,
+                                jy_lstart, nat, nm, nbes),
+                    _block_view(B, ao_start, ao_stride, ao_lstart,
+                                nat, nm, nzeta),
+                    axes=(list(range(A.ndim + 1)),) * 2).real
+                for A, B in terms)
+
+            grad.set_block(itype, l, g)
+
+        return grad.tolist() if self._nested else grad
+
+
+def _block_view(X, start, stride, lstart, nat, nm, n):
+    '''
+    View of the last axis of X as (..., nat, nm, n) that selects
+    X[..., start + iat*stride + lstart + im*n + i] for all (iat, im, i).
+
+    '''
+    return X[..., start:start+nat*stride] \
+            .reshape(X.shape[:-1] + (nat, stride)) \
+            [..., lstart:lstart+nm*n] \
+            .reshape(X.shape[:-1] + (nat, nm, n))
+
+
 ############################################################
 #                           Test
 ############################################################
@@ -107,6 +401,111 @@ class _TestBasisTrans(unittest.TestCase):
             irow += nbes[itype][l]
 
 
+    def test_block_jy2ao(self):
+        nbes  = [[11, 10, 9, 8], [7, 6], [5], [4, 3], [2]]
+        nzeta = [[3, 0, 4]     , [0, 9], [] , [2, 0], [1]] # nzeta[itype][l]
+        coef = [[np.random.randn(nzeta_tl, nbes[it][l] - (l+it) % 2).tolist()
+                 for l, nzeta_tl in enumerate(nzeta_t)]
+                for it, nzeta_t in enumerate(nzeta)]
+        natom = [1, 2, 3, 4, 5]
+
+        M = jy2ao(coef, natom, nbes)
+        op = BlockJy2ao(coef, natom, nbes)
+
+        nrow, ncol = M.shape
+        self.assertEqual(op.shape, (nrow, ncol))
+        self.assertEqual(op.T.shape, (ncol, nrow))
+        self.assertTrue(np.array_equal(op.toarray(), M))
+        self.assertTrue(np.array_equal(op.T.toarray(), M.T))
+
+        X = np.random.randn(2, 3, 4, nrow) + 1j * np.random.randn(4, nrow)
+        self.assertTrue(np.allclose(X @ op, X @ M))
+        self.assertTrue(np.allclose(op.T @ X.swapaxes(-1, -2),
+                                    M.T @ X.swapaxes(-1, -2)))
+
+        Y = np.random.randn(3, ncol)
+        self.assertTrue(np.allclose(Y @ op.T, Y @ M.T))
+        self.assertTrue(np.allclose(op @ Y.T, M @ Y.T))
+
+        # single precision is preserved
+        self.assertEqual((X.astype(np.complex64) @ op).dtype, np.complex64)
+        self.assertEqual((op.T @ X.swapaxes(-1, -2).real.astype(np.float32))
+                         .dtype, np.float32)
+
+        # chained products with stacked matrices
+        S = np.random.randn(2, 5, nrow, nrow)
+        self.assertTrue(np.allclose(op.T @ S @ op, M.T @ S @ M))
+
+
+    def test_block_jy2ao_coef_grad(self):
+        from SIAB.spillage.listmanip import flatten, nest, nestpat
+
+        nbes  = [[11, 10, 9, 8], [7, 6], [5], [4, 3], [2]]
+        nzeta = [[3, 0, 4]     , [0, 9], [] , [2, 0], [1]] # nzeta[itype][l]
+        coef = [[np.random.randn(nzeta_tl, nbes[it][l] - (l+it) % 2).tolist()
+                 for l, nzeta_tl in enumerate(nzeta_t)]
+                for it, nzeta_t in enumerate(nzeta)]
+        natom = [1, 2, 3, 4, 5]
+
+        nrow = _nao(natom, nbes)
+        ncol = _nao(natom, nzeta)
+        A = np.random.randn(2, 3, nrow, 7) + 1j * np.random.randn(nrow, 7)
+        B = np.random.randn(2, 3, 7, ncol) + 1j * np.random.randn(7, ncol)
+        A2 = np.random.randn(4, nrow, 5)
+        B2 = np.random.randn(4, 5, ncol)
+
+        op = BlockJy2ao(coef, natom, nbes)
+        grad = op.coef_grad([(A, B), (A2, B2)])
+        self.assertEqual(nestpat(grad), nestpat(coef))
+
+        # f(coef) = sum(G * jy2ao(coef)) is linear in coef, so its
+        # gradient w.r.t. each coefficient can be read off by unit vectors
+        G = (A @ B).real.sum((0, 1)) + (A2 @ B2).sum(0)
+        pat = nestpat(coef)
+        ncoef = len(flatten(coef))
+        grad_ref = [np.sum(G * jy2ao(nest(ci.tolist(), pat), natom, nbes))
+                    for ci in np.eye(ncoef)]
+
+        self.assertTrue(np.allclose(flatten(grad), grad_ref))
+
+        # FlatCoef in, FlatCoef out
+        grad_flat = BlockJy2ao(FlatCoef(coef), natom, nbes) \
+                .coef_grad([(A, B), (A2, B2)])
+        self.assertTrue(isinstance(grad_flat, FlatCoef))
+        self.assertTrue(np.allclose(grad_flat.data, grad_ref))
+
+
+    def test_flat_coef(self):
+        from SIAB.spillage.listmanip import flatten
+
+        # ragged coef[itype][l][zeta] and empty l
+        coef = [[[[1., 2., 3.], [4., 5.]], [], [[6.], [7.], [8.]]],
+                [[[9., 10.]]]]
+        fc = FlatCoef(coef)
+        self.assertEqual(fc.data.tolist(), flatten(coef))
+        self.assertEqual(fc.ncoef, [[[3, 2], [], [1, 1, 1]], [[2]]])
+        self.assertEqual(fc.tolist(), coef)
+        self.assertEqual(FlatCoef(fc).tolist(), coef)
+
+        self.assertTrue(np.array_equal(fc.block(0, 0),
+                                       [[1., 4.], [2., 5.], [3., 0.]]))
+        self.assertTrue(np.array_equal(fc.block(0, 2, 2),
+                                       [[6., 7., 8.], [0., 0., 0.]]))
+        self.assertEqual(fc.block(0, 1).shape, (0, 0))
+
+        data = np.arange(len(fc.data)) * 1.0
+        fc2 = fc.like(data)
+        self.assertTrue(fc2.data is data)
+        fc2.set_block(0, 0, np.array([[-1., -4.], [-2., -5.], [-3., -6.]]))
+        self.assertEqual(fc2.tolist()[0][0], [[-1., -2., -3.], [-4., -5.]])
+        self.assertEqual(fc.tolist(), coef)
+
+        natom = [2, 1]
+        nbes = [[4, 2, 3], [5]]
+        self.assertTrue(np.array_equal(jy2ao(fc, natom, nbes),
+                                       jy2ao(coef, natom, nbes)))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -1,13 +1,114 @@
+import os
 import re
+import json
+import hashlib
+import functools
 import numpy as np
 import itertools
 from scipy.sparse import csr_matrix
 
-from SIAB.spillage.jlzeros import JLZEROS
 from SIAB.spillage.index import _lin2comp
 
 
-def read_orb_mat(fpath):
+# version of the on-disk layout of the orb_matrix binary cache;
+# bump it whenever the cached content or its layout changes.
+_ORB_MAT_CACHE_VERSION = 1
+
+# arrays of read_orb_mat that are stored as individual .npy files
+_ORB_MAT_CACHE_ARRAYS = ['kpt', 'wk', 'ref_jy', 'jy_jy', 'ref_ref']
+
+
+def _orb_mat_cache_dir(fpath):
+    '''
+    Path of the cache directory of an "orb_matrix" file.
+
+    Caches are not written next to the data but to a subdirectory (named
+    after the absolute path of the file) of the directory specified by the
+    environment variable SIAB_CACHE_DIR; it defaults to ~/.cache/SIAB.
+
+    '''
+    cache_dir = os.environ.get('SIAB_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'),
+                                            '.cache', 'SIAB'))
+    key = hashlib.sha1(os.path.abspath(fpath).encode()).hexdigest()
+    return os.path.join(cache_dir, 'orb_matrix', key)
+
+
+def _orb_mat_stamp(fpath):
+    '''
+    Key that identifies the content of an "orb_matrix" file.
+
+    The cache is considered valid only if the file path, size and
+    modification time all agree with the ones recorded in the cache.
+
+    '''
+    st = os.stat(fpath)
+    return {'version': _ORB_MAT_CACHE_VERSION,
+            'path': os.path.abspath(fpath),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns}
+
+
+def _orb_mat_cache_load(fpath):
+    '''
+    Loads the parsed data of an "orb_matrix" file from its cache.
+
+    Arrays are memory-mapped in read-only mode. Returns None if the cache
+    does not exist or is outdated.
+
+    '''
+    cache_dir = _orb_mat_cache_dir(fpath)
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        if meta['stamp'] != _orb_mat_stamp(fpath):
+            return None
+
+        dat = meta['data']
+        for key in _ORB_MAT_CACHE_ARRAYS:
+            dat[key] = np.load(os.path.join(cache_dir, f'{key}.npy'),
+                               mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    dat['lin2comp'] = _lin2comp(dat['natom'], lmax=dat['lmax'])
+    return dat
+
+
+def _orb_mat_cache_save(fpath, dat):
+    '''
+    Saves the parsed data of an "orb_matrix" file to its cache.
+
+    Each array is written to its own .npy file so that it can be memory-
+    mapped on load. The metadata file is written last (and atomically),
+    so a partially written cache is never considered valid. Failures
+    (e.g., read-only file systems) are silently ignored.
+
+    '''
+    cache_dir = _orb_mat_cache_dir(fpath)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        for key in _ORB_MAT_CACHE_ARRAYS:
+            ftmp = os.path.join(cache_dir, f'{key}.{os.getpid()}.tmp.npy')
+            np.save(ftmp, dat[key])
+            os.replace(ftmp, os.path.join(cache_dir, f'{key}.npy'))
+
+        meta = {'stamp': _orb_mat_stamp(fpath),
+                'data': {key: val for key, val in dat.items()
+                         if key not in _ORB_MAT_CACHE_ARRAYS
+                         and key != 'lin2comp'}}
+
+        ftmp = os.path.join(cache_dir, f'meta.{os.getpid()}.tmp.json')
+        with open(ftmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(ftmp, os.path.join(cache_dir, 'meta.json'))
+    except OSError:
+        pass
+
+
+def read_orb_mat(fpath, cache=True):
     '''
     Reads an "orb_matrix" data file.
 
@@ -20,6 +121,17 @@ def read_orb_mat(fpath):
     ----------
         fpath : str
             Path of an "orb_matrix" data file.
+        cache : bool
+            If True, the parsed data is saved as binary .npy files to the
+            cache directory (see _orb_mat_cache_dir) on the first call, and
+            subsequent calls memory-map the arrays from there instead of
+            parsing the text file again. The cache is invalidated whenever
+            the size or modification time of the file changes.
+            Within a process, the memory-mapped data are further memoized,
+            so that repeated calls on the same (unchanged) file return the
+            same read-only arrays without any file access beyond a stat.
+            If the cache cannot be written, the data is parsed on every
+            call (and not memoized, to avoid holding it in memory).
 
     Returns
     -------
@@ -79,11 +191,238 @@ def read_orb_mat(fpath):
     (Although MO-MO overlaps in theory can be used to distinguish them,
     it's not a good practice.)
 
+    Arrays loaded from the cache are read-only memory maps.
+
     '''
-    with open(fpath, 'r') as f:
-        data = f.read()
-        data = data.replace('\n', ' ').split()
+    if cache:
+        stamp = _orb_mat_stamp(fpath)
+        key = (stamp['path'], stamp['size'], stamp['mtime_ns'])
+        try:
+            # a shallow copy keeps the memoized dict itself intact
+            return dict(_read_orb_mat_memo(*key))
+        except LookupError: # no valid on-disk cache yet
+            pass
+
+        dat = _read_orb_mat_txt(fpath, cache=True)
+        _orb_mat_cache_save(fpath, dat)
+        try:
+            return dict(_read_orb_mat_memo(*key))
+        except LookupError: # the cache cannot be written
+            return dat
+
+    return _read_orb_mat_txt(fpath)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_orb_mat_memo(fpath, size, mtime_ns):
+    '''
+    Process-wide memoization of the memory-mapped data of the on-disk
+    cache of an "orb_matrix" file (see read_orb_mat).
+
+    size and mtime_ns are part of the key so that a modified file is
+    read again. Arrays are made read-only since they are shared among
+    callers. Only memory maps are memoized, so memoized entries do not
+    hold the data in memory; LookupError is raised (and not memoized)
+    if the cache is not available.
+
+    '''
+    dat = _orb_mat_cache_load(fpath)
+    if dat is None:
+        raise LookupError(f'no valid cache of {fpath}')
+
+    for val in dat.values():
+        if isinstance(val, np.ndarray):
+            val.setflags(write=False)
+
+    return dat
+
+
+def _orb_mat_sections(fpath, chunk_size=1<<24):
+    '''
+    Locates the tagged sections of an "orb_matrix" file.
+
+    The file is scanned in binary chunks of `chunk_size` bytes, so the
+    memory footprint is bounded regardless of the file size.
+
+    Returns
+    -------
+        A dict that maps each tag (e.g., 'OVERLAP_Q') to a 2-tuple
+        (start, end) of byte offsets, where start is the offset right
+        after <tag> and end is the offset of </tag>.
+
+    '''
+    pat = re.compile(rb'<(/?)(\w+)>')
+
+    # matches that end within the trailing `overlap` bytes of a chunk have
+    # been found already; the overlap must exceed the length of any tag.
+    overlap = 64
+
+    start, end = {}, {}
+    with open(fpath, 'rb') as f:
+        pos = 0 # absolute offset of the end of buf
+        tail = b''
+        while chunk := f.read(chunk_size):
+            buf = tail + chunk
+            base = pos - len(tail) # absolute offset of buf[0]
+            for m in pat.finditer(buf):
+                if m.end() <= len(tail):
+                    continue
+                tag = m.group(2).decode()
+                if m.group(1):
+                    end[tag] = base + m.start()
+                else:
+                    start[tag] = base + m.end()
+            pos += len(chunk)
+            tail = buf[-overlap:]
+
+    return {tag: (start[tag], end[tag]) for tag in start if tag in end}
+
+
+def read_orb_mat_index(fpath, cache=True):
+    '''
+    Byte offsets of the tagged sections of an "orb_matrix" file, so that
+    readers can seek straight to the needed section.
+
+    Parameters
+    ----------
+        fpath : str
+            Path of an "orb_matrix" data file.
+        cache : bool
+            If True, the index is saved to "sections.json" in the cache
+            directory of read_orb_mat on the first call, and subsequent
+            calls load it from there instead of scanning the file again.
+            The index is invalidated whenever the size or modification
+            time of the file changes.
+
+    Returns
+    -------
+        A dict that maps each tag (e.g., 'OVERLAP_Q') to a 2-tuple
+        (start, end) of byte offsets, where start is the offset right
+        after <tag> and end is the offset of </tag>.
 
+    '''
+    if not cache:
+        return _orb_mat_sections(fpath)
+
+    findex = os.path.join(_orb_mat_cache_dir(fpath), 'sections.json')
+    stamp = _orb_mat_stamp(fpath)
+    try:
+        with open(findex, 'r') as f:
+            index = json.load(f)
+        if index['stamp'] == stamp:
+            return {tag: tuple(pos) for tag, pos in index['sections'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sections = _orb_mat_sections(fpath)
+
+    # same as _orb_mat_cache_save: atomic, failures are silently ignored
+    try:
+        os.makedirs(_orb_mat_cache_dir(fpath), exist_ok=True)
+        ftmp = findex + f'.{os.getpid()}.tmp'
+        with open(ftmp, 'w') as f:
+            json.dump({'stamp': stamp, 'sections': sections}, f)
+        os.replace(ftmp, findex)
+    except OSError:
+        pass
+
+    return sections
+
+
+def _read_orb_mat_block(f, sections, tag, count):
+    '''
+    Parses `count` floats from the section `tag` of an opened (binary)
+    "orb_matrix" file directly into an array.
+
+    '''
+    if tag not in sections:
+        raise ValueError(f'BROKEN FILE: no complete <{tag}> section found '
+                         f'in {f.name}.')
+
+    f.seek(sections[tag][0])
+    dat = np.fromfile(f, dtype=float, count=count, sep=' ')
+
+    # np.fromfile may stop early (with a warning) at the closing tag
+    # if the section is shorter than expected
+    if dat.size != count or f.tell() > sections[tag][1]:
+        raise ValueError(f'BROKEN FILE: size of <{tag}> in {f.name} '
+                         f'does not agree with its header.')
+
+    return dat
+
+
+def _read_orb_mat_txt(fpath, cache=False):
+    '''
+    Parses an "orb_matrix" text file. See read_orb_mat for details.
+
+    Instead of tokenizing the whole file, the tagged sections are located
+    by a chunked scan (or taken from the cached index if cache is True,
+    see read_orb_mat_index), and each matrix block is parsed by numpy's
+    C-level text reader straight into its final array.
+
+    '''
+    sections = read_orb_mat_index(fpath, cache)
+
+    with open(fpath, 'rb') as f:
+        # header: everything before <OVERLAP_Q>, which is small
+        header = _parse_orb_mat_header(
+                f.read(sections['OVERLAP_Q'][0]).decode().split())
+
+        natom, lmax = header['natom'], header['lmax']
+        nk, nbands, nbes = header['nk'], header['nbands'], header['nbes']
+
+        ################################################################
+        #   bijective map between the composite and linearized indices
+        ################################################################
+        lin2comp = _lin2comp(natom, lmax=lmax)
+        nao = len(lin2comp)
+
+        ################################################################
+        #                           MO-jY overlap
+        ################################################################
+        ref_jy = _read_orb_mat_block(f, sections, 'OVERLAP_Q',
+                                     2 * nk * nbands * nao * nbes) \
+                .view(dtype=complex) \
+                .reshape((nk, nbands, nao*nbes))
+
+        # abacus outputs <jy|mo>, so a conjugate is needed
+        np.conjugate(ref_jy, out=ref_jy)
+
+        ################################################################
+        #                           jY-jY overlap
+        ################################################################
+        jy_jy = _read_orb_mat_block(f, sections, 'OVERLAP_Sq',
+                                    2 * nk * nao * nao * nbes * nbes) \
+                .view(dtype=complex) \
+                .reshape((nk, nao, nao, nbes, nbes))
+
+        if np.linalg.norm(np.imag(jy_jy.reshape(-1)), np.inf) < 1e-12:
+            jy_jy = np.real(jy_jy)
+
+        # permute jy_jy from (nk, nao, nao, nbes, nbes) to
+        # (nk, nao, nbes, nao, nbes) for convenience later.
+        jy_jy = jy_jy \
+                .transpose((0, 1, 3, 2, 4)) \
+                .reshape((nk, nao*nbes, nao*nbes))
+
+        ################################################################
+        #                           MO-MO overlap
+        ################################################################
+        # should be all 1
+        ref_ref = _read_orb_mat_block(f, sections, 'OVERLAP_V',
+                                      nk * nbands) \
+                .reshape((nk, nbands))
+
+    return header | {'jy_jy': jy_jy, 'ref_jy': ref_jy, 'ref_ref': ref_ref,
+                     'lin2comp': lin2comp}
+
+
+def _parse_orb_mat_header(data):
+    '''
+    Parses the header (everything before <OVERLAP_Q>, split into tokens)
+    of an "orb_matrix" file. See read_orb_mat_header for details.
+
+    '''
     ntype = int(data[data.index('ntype') - 1])
     natom = [int(data[i-1]) \
             for i, label in enumerate(data[:data.index('ecutwfc')]) \
@@ -105,8 +444,9 @@ def read_orb_mat(fpath):
     nbands = int(data[data.index('nbands') - 1])
     nbes = int(data[data.index('ne') - 1])
 
-    # NOTE In PW calculations, lmax is always the same for all element types,
-    # which is the lmax read above. (Will it be different in the future?)
+    # NOTE In PW calculations, lmax is always the same for all element
+    # types, which is the lmax read above. (Will it be different in the
+    # future?)
     lmax = [lmax] * ntype
 
     wk_start = data.index('<WEIGHT_OF_KPOINTS>') + 1
@@ -115,57 +455,35 @@ def read_orb_mat(fpath):
     kpt = kinfo[:, 0:3]
     wk = kinfo[:, 3]
 
-    ####################################################################
-    #   bijective map between the composite and linearized indices
-    ####################################################################
-    lin2comp = _lin2comp(natom, lmax=lmax)
-    nao = len(lin2comp)
-
-    ####################################################################
-    #                           MO-jY overlap
-    ####################################################################
-    ref_jy_start= data.index('<OVERLAP_Q>') + 1
-    ref_jy_end = data.index('</OVERLAP_Q>')
-    ref_jy = np.array(data[ref_jy_start:ref_jy_end], dtype=float) \
-            .view(dtype=complex) \
-            .reshape((nk, nbands, nao*nbes)) \
-            .conj() # abacus outputs <jy|mo>, so a conjugate is needed
-
-
-    ####################################################################
-    #                           jY-jY overlap
-    ####################################################################
-    jy_jy_start= data.index('<OVERLAP_Sq>') + 1
-    jy_jy_end = data.index('</OVERLAP_Sq>')
-    jy_jy = np.array(data[jy_jy_start:jy_jy_end], dtype=float) \
-            .view(dtype=complex) \
-            .reshape((nk, nao, nao, nbes, nbes))
-
-    if np.linalg.norm(np.imag(jy_jy.reshape(-1)), np.inf) < 1e-12:
-        jy_jy = np.real(jy_jy)
-
-    # permute jy_jy from (nk, nao, nao, nbes, nbes) to
-    # (nk, nao, nbes, nao, nbes) for convenience later.
-    jy_jy = jy_jy \
-            .transpose((0, 1, 3, 2, 4)) \
-            .reshape((nk, nao*nbes, nao*nbes))
-
-    ####################################################################
-    #                           MO-MO overlap
-    ####################################################################
-    # should be all 1
-    ref_ref_start= data.index('<OVERLAP_V>') + 1
-    ref_ref_end = data.index('</OVERLAP_V>')
-    ref_ref = np.array(data[ref_ref_start:ref_ref_end], dtype=float)
-
-    assert len(ref_ref) == nbands * nk
-    ref_ref = ref_ref.reshape((nk, nbands))
-
     return {'ntype': ntype, 'natom': natom, 'ecutwfc': ecutwfc,
             'ecutjlq': ecutjlq, 'rcut': rcut, 'lmax': lmax, 'nk': nk,
-            'nbands': nbands, 'nbes': nbes, 'kpt': kpt, 'wk': wk,
-            'jy_jy': jy_jy, 'ref_jy': ref_jy, 'ref_ref': ref_ref,
-            'lin2comp': lin2comp}
+            'nbands': nbands, 'nbes': nbes, 'kpt': kpt, 'wk': wk}
+
+
+def read_orb_mat_header(fpath, chunk_size=1<<16):
+    '''
+    Reads the header of an "orb_matrix" data file without touching its
+    matrix blocks, e.g., to select files by rcut.
+
+    Only the beginning of the file (up to <OVERLAP_Q>) is read.
+
+    Returns
+    -------
+        A dictionary with the keys ntype, natom, ecutwfc, ecutjlq, rcut,
+        lmax, nk, nbands, nbes, kpt and wk of read_orb_mat.
+
+    '''
+    tag = b'<OVERLAP_Q>'
+    buf = b''
+    with open(fpath, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            buf += chunk
+            # the tag may straddle two chunks
+            i = buf.find(tag, max(0, len(buf) - len(chunk) - len(tag)))
+            if i >= 0:
+                return _parse_orb_mat_header(buf[:i].decode().split())
+
+    raise ValueError(f'BROKEN FILE: no <OVERLAP_Q> section found in {fpath}.')
 
 
 def read_wfc_lcao_txt(fname):
@@ -184,29 +502,34 @@ def read_wfc_lcao_txt(fname):
         k : array
             k-point Cartesian coordinates (not direct coordinates!).
 
+    Note
+    ----
+    All numbers of the file are parsed in one pass into a single array
+    after the labels like "(band)" are stripped. wfc, e and occ are views
+    of this array (wfc is not contiguous).
+
     '''
-    with open(fname, 'r') as f:
+    with open(fname, 'rb') as f:
         data = f.read()
-        data = data.replace('\n', ' ').split()
 
-    if 'k' in data:
-        is_gamma = False
-        start = data.index('k') + 2
-        k = np.array([float(data[i]) for i in range(start, start + 3)])
-    else:
-        is_gamma = True
-        k = np.array([0., 0., 0.])
+    is_gamma = b'(index of k points)' not in data
 
-    nfloat_each_band = int(data[data.index('orbitals)') - 3]) \
-                        * (1 if is_gamma else 2)
+    # after the labels are stripped, the file is a plain stream of numbers:
+    #   [ik kx ky kz] nbands nao {iband e occ c[0] c[1] ...} * nbands
+    data = np.fromstring(re.sub(rb'\([^)]*\)', b' ', data).decode(),
+                         sep=' ')
 
-    # use the string "(band)" as delimiters
-    delim = [i for i, x in enumerate(data) if x == '(band)']
+    nhead = 2 if is_gamma else 6
+    nbands, nao = map(int, data[nhead-2:nhead])
+    nfloat_each_band = nao * (1 if is_gamma else 2)
 
-    e = np.array([float(data[i+1]) for i in delim])
-    occ = np.array([float(data[i+3]) for i in delim])
-    wfc = np.array([[float(c) for c in data[i+5:i+5+nfloat_each_band]]
-                    for i in delim])
+    assert data.size == nhead + nbands * (3 + nfloat_each_band)
+    bands = data[nhead:].reshape(nbands, 3 + nfloat_each_band)
+
+    k = np.array([0., 0., 0.]) if is_gamma else data[1:4]
+    e = bands[:, 1]
+    occ = bands[:, 2]
+    wfc = bands[:, 3:]
 
     if not is_gamma:
         wfc = wfc.view(complex)
@@ -256,6 +579,23 @@ def read_csr(fname):
     return mat, R
 
 
+# translation table that replaces the delimiters of "(re,im)" by spaces
+_TRIU_DELIM = bytes.maketrans(b'(),', b'   ')
+
+
+@functools.lru_cache(maxsize=8)
+def _triu_tril_indices(sz):
+    '''
+    Indices of the upper triangle (including the diagonal) and the strict
+    lower triangle of a square matrix of size sz.
+
+    The results are cached since read_triu is typically called many times
+    (S & T for each k-point) with the same matrix size.
+
+    '''
+    return np.triu_indices(sz), np.tril_indices(sz, -1)
+
+
 def read_triu(fname):
     '''
     Read an upper triangular matrix file generated by ABACUS.
@@ -269,25 +609,30 @@ def read_triu(fname):
     for multiple-k calculations.
 
     '''
-    with open(fname, 'r') as f:
+    with open(fname, 'rb') as f:
         data = f.read()
-        data = re.sub('\(|\)|,|\n', ' ', data).split()
+
+    # Strip the parentheses & commas of complex numbers "(re,im)" and let
+    # numpy parse the whole text at the C level (no per-element Python
+    # float is created).
+    data = np.fromstring(data.translate(_TRIU_DELIM).decode(), sep=' ')
 
     # the first element of the file is the size of the matrix
     sz = int(data[0])
     assert len(data) == sz*(sz+1)//2 + 1 or len(data) == sz*(sz+1) + 1
     dtype = complex if len(data) == sz*(sz+1) + 1 else float
 
-    M = np.zeros((sz, sz), dtype=dtype)
-    idx_u = np.triu_indices(sz)
-    M[idx_u] = np.array([float(x) for x in data[1:]]).view(dtype)
+    idx_u, idx_l = _triu_tril_indices(sz)
+
+    M = np.empty((sz, sz), dtype=dtype)
+    M[idx_u] = data[1:].view(dtype)
 
     # symmetrize the matrix
-    idx_l = np.tril_indices(sz)
     M[idx_l] = M.T[idx_l].conj()
 
     # make diagonal elements real (fix floating point error)
-    M[np.diag_indices(sz)] = np.real(M[np.diag_indices(sz)])
+    if dtype == complex:
+        M.flat[::sz+1] = M.diagonal().real
 
     return M
 
@@ -404,7 +749,7 @@ class _TestDatParse(unittest.TestCase):
         here = os.path.dirname(__file__)
         fpath = os.path.join(here, 'testfiles/Si/pw/dimer-1.8-gamma/orb_matrix.0.dat')
         #fpath = './testfiles/Si/pw/dimer-1.8-gamma/orb_matrix.0.dat'
-        dat = read_orb_mat(fpath)
+        dat = read_orb_mat(fpath, cache=False)
 
         nbes0 = int(np.sqrt(dat['ecutjlq']) * dat['rcut'] / np.pi)
 
@@ -431,7 +776,7 @@ class _TestDatParse(unittest.TestCase):
 
         fpath = os.path.join(here, 'testfiles/Si/pw/trimer-1.7-gamma/orb_matrix.1.dat')
         #fpath = './testfiles/Si/pw/trimer-1.7-gamma/orb_matrix.1.dat'
-        dat = read_orb_mat(fpath)
+        dat = read_orb_mat(fpath, cache=False)
 
         nbes0 = int(np.sqrt(dat['ecutjlq']) * dat['rcut'] / np.pi)
 
@@ -458,6 +803,150 @@ class _TestDatParse(unittest.TestCase):
                          (dat['nk'], dat['nbands']))
 
 
+    def test_read_orb_mat_cache(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+        here = os.path.dirname(__file__)
+        src = os.path.join(here, 'testfiles/Si/pw/dimer-1.8-gamma/orb_matrix.0.dat')
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.dict(os.environ, {'SIAB_CACHE_DIR': cache_dir}):
+            fpath = os.path.join(tmpdir, 'orb_matrix.0.dat')
+            shutil.copy(src, fpath)
+
+            ref = read_orb_mat(fpath, cache=False)
+            self.assertFalse(os.path.exists(_orb_mat_cache_dir(fpath)))
+
+            # the first call parses the text file and creates the cache
+            # (in SIAB_CACHE_DIR, nothing is written next to the data)
+            dat = read_orb_mat(fpath)
+            self.assertTrue(os.path.isdir(_orb_mat_cache_dir(fpath)))
+            self.assertTrue(_orb_mat_cache_dir(fpath).startswith(cache_dir))
+            self.assertEqual(os.listdir(tmpdir), ['orb_matrix.0.dat'])
+            self.assertIsNotNone(_orb_mat_cache_load(fpath))
+
+            # the second call loads memory-mapped arrays from the cache
+            dat = read_orb_mat(fpath)
+            self.assertIsInstance(dat['jy_jy'], np.memmap)
+            self.assertEqual(dat.keys(), ref.keys())
+            for key in ref:
+                if isinstance(ref[key], np.ndarray):
+                    self.assertEqual(dat[key].dtype, ref[key].dtype)
+                    self.assertTrue(np.array_equal(dat[key], ref[key]))
+                else:
+                    self.assertEqual(dat[key], ref[key])
+
+            # modifying the file invalidates the cache
+            with open(fpath, 'a') as f:
+                f.write('\n')
+            self.assertIsNone(_orb_mat_cache_load(fpath))
+            dat = read_orb_mat(fpath)
+            self.assertTrue(np.array_equal(dat['ref_jy'], ref['ref_jy']))
+            self.assertIsNotNone(_orb_mat_cache_load(fpath))
+
+            # memoized within the process: the same read-only arrays
+            dat2 = read_orb_mat(fpath)
+            self.assertIsNot(dat2, dat)
+            self.assertIs(dat2['jy_jy'], dat['jy_jy'])
+            self.assertFalse(dat2['jy_jy'].flags.writeable)
+
+            # data parsed from the text file are not memoized if the
+            # cache cannot be written
+            with open(fpath, 'a') as f:
+                f.write('\n')
+            with mock.patch(__name__ + '._orb_mat_cache_save'):
+                dat = read_orb_mat(fpath)
+                dat2 = read_orb_mat(fpath)
+            self.assertNotIsInstance(dat['jy_jy'], np.memmap)
+            self.assertIsNot(dat2['jy_jy'], dat['jy_jy'])
+            self.assertTrue(np.array_equal(dat2['jy_jy'], ref['jy_jy']))
+
+
+    def test_read_orb_mat_header(self):
+        import os
+        here = os.path.dirname(__file__)
+        for fname in ['pw/dimer-1.8-gamma/orb_matrix.0.dat',
+                      'pw/dimer-1.8-gamma/orb_matrix.1.dat']:
+            fpath = os.path.join(here, 'testfiles/Si', fname)
+            ref = read_orb_mat(fpath, cache=False)
+
+            # tags straddling chunk boundaries must be found as well
+            for chunk_size in [7, 1<<16]:
+                header = read_orb_mat_header(fpath, chunk_size)
+                self.assertEqual(set(header), set(ref) - {'jy_jy', 'ref_jy',
+                                                          'ref_ref', 'lin2comp'})
+                for key, val in header.items():
+                    if isinstance(val, np.ndarray):
+                        self.assertTrue(np.array_equal(val, ref[key]))
+                    else:
+                        self.assertEqual(val, ref[key])
+
+
+    def test_orb_mat_sections(self):
+        import os
+        import tempfile
+        here = os.path.dirname(__file__)
+        fpath = os.path.join(here, 'testfiles/Si/pw/dimer-1.8-gamma/orb_matrix.0.dat')
+
+        sections = _orb_mat_sections(fpath)
+        self.assertEqual(set(sections), {'WEIGHT_OF_KPOINTS', 'OVERLAP_Q',
+                                         'OVERLAP_Sq', 'OVERLAP_V'})
+
+        with open(fpath, 'rb') as f:
+            txt = f.read()
+        for tag, (start, end) in sections.items():
+            self.assertEqual(txt[start-len(tag)-2:start], f'<{tag}>'.encode())
+            self.assertEqual(txt[end:end+len(tag)+3], f'</{tag}>'.encode())
+
+        # tags straddling chunk boundaries must be found as well
+        self.assertEqual(_orb_mat_sections(fpath, chunk_size=7), sections)
+
+        # a truncated file is reported as broken
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fbroken = os.path.join(tmpdir, 'orb_matrix.0.dat')
+            with open(fbroken, 'wb') as f:
+                f.write(txt[:sections['OVERLAP_Sq'][0] + 1000])
+            with self.assertRaises(ValueError):
+                read_orb_mat(fbroken, cache=False)
+
+
+    def test_read_orb_mat_index(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+        here = os.path.dirname(__file__)
+        src = os.path.join(here, 'testfiles/Si/pw/dimer-1.8-gamma/orb_matrix.0.dat')
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch.dict(os.environ, {'SIAB_CACHE_DIR': cache_dir}):
+            fpath = os.path.join(tmpdir, 'orb_matrix.0.dat')
+            shutil.copy(src, fpath)
+            findex = os.path.join(_orb_mat_cache_dir(fpath), 'sections.json')
+
+            ref = _orb_mat_sections(fpath)
+            self.assertEqual(read_orb_mat_index(fpath, cache=False), ref)
+            self.assertFalse(os.path.exists(findex))
+
+            # saved on the first call, loaded afterwards
+            self.assertEqual(read_orb_mat_index(fpath), ref)
+            self.assertTrue(os.path.exists(findex))
+            self.assertEqual(read_orb_mat_index(fpath), ref)
+
+            # a modified file invalidates the index
+            with open(fpath, 'rb') as f:
+                txt = f.read()
+            with open(fpath, 'wb') as f:
+                f.write(b'\n' + txt)
+            self.assertEqual(read_orb_mat_index(fpath),
+                             {tag: (start + 1, end + 1)
+                              for tag, (start, end) in ref.items()})
+
+
     def test_read_csr(self):
         # the test data is generated by ABACUS with integration test
         # 201_NO_15_f_pseudopots (a single Cerium atom)
@@ -1,3 +1,6 @@
+import os
+import threading
+
 import numpy as np
 from scipy.special import spherical_jn
 
@@ -99,10 +102,110 @@ def bracket(l, nzeros, return_all=False):
     return list(_zerogen()) if return_all else next(_zerogen())
 
 
-# tabulate some frequently used zeros
+# version of the on-disk cache of tabulated zeros; bump it whenever the
+# algorithm or the tolerance of `bracket` changes.
+_JLZEROS_CACHE_VERSION = 1
+
+
+def _jlzeros_cache_file():
+    '''
+    Path of the on-disk cache of tabulated zeros.
+
+    The cache directory can be specified by the environment variable
+    SIAB_CACHE_DIR; it defaults to ~/.cache/SIAB.
+
+    '''
+    cache_dir = os.environ.get('SIAB_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'),
+                                            '.cache', 'SIAB'))
+    return os.path.join(cache_dir, f'jlzeros_v{_JLZEROS_CACHE_VERSION}.npy')
+
+
+def _jlzeros_tabulate(lmax, nzeros):
+    '''
+    Returns a 2-d array that contains (at least) the first `nzeros` zeros
+    of spherical Bessel functions of order 0, 1, ..., lmax (row-wise).
+
+    The table is loaded from the on-disk cache if the latter is large
+    enough; otherwise it is computed and the cache is (re)written.
+    Failures in reading or writing the cache are silently ignored.
+
+    '''
+    fcache = _jlzeros_cache_file()
+    try:
+        zeros = np.load(fcache)
+        if zeros.shape[0] > lmax and zeros.shape[1] >= nzeros:
+            return zeros
+        # never shrink the cache
+        lmax = max(lmax, zeros.shape[0] - 1)
+        nzeros = max(nzeros, zeros.shape[1])
+    except (OSError, ValueError):
+        pass
+
+    zeros = np.array(bracket(lmax, nzeros, return_all=True))
+
+    try:
+        os.makedirs(os.path.dirname(fcache), exist_ok=True)
+        ftmp = f'{fcache}.{os.getpid()}.tmp.npy'
+        np.save(ftmp, zeros)
+        os.replace(ftmp, fcache)
+    except OSError:
+        pass
+
+    return zeros
+
+
+class _JlZeros:
+    '''
+    Lazily tabulated zeros of spherical Bessel functions.
+
+    JLZEROS[l] gives an array of the first few positive zeros of the l-th
+    order spherical Bessel function. The table is not computed until it is
+    first accessed, in which case it is loaded from an on-disk cache (see
+    _jlzeros_cache_file) or computed by `bracket` otherwise.
+
+    Accessing an l beyond the present table extends it automatically;
+    more zeros per l can be requested by `extend`.
+
+    '''
+
+    def __init__(self, lmax, nzeros):
+        self.lmax = lmax
+        self.nzeros = nzeros
+        self._zeros = None
+        self._lock = threading.Lock()
+
+
+    def extend(self, lmax=0, nzeros=0):
+        '''
+        Makes sure the table contains at least the first `nzeros` zeros
+        for orders up to `lmax`.
+
+        '''
+        with self._lock:
+            lmax = max(lmax, self.lmax)
+            nzeros = max(nzeros, self.nzeros)
+            if self._zeros is None or self._zeros.shape[0] <= lmax \
+                    or self._zeros.shape[1] < nzeros:
+                self._zeros = _jlzeros_tabulate(lmax, nzeros)
+                self.lmax = self._zeros.shape[0] - 1
+                self.nzeros = self._zeros.shape[1]
+
+
+    def __getitem__(self, l):
+        if self._zeros is None or l > self.lmax:
+            self.extend(lmax=l)
+        return self._zeros[l]
+
+
+    def __len__(self):
+        return self.lmax + 1
+
+
+# tabulate some frequently used zeros (lazily)
 JLZEROS_LMAX = 20
 JLZEROS_NZEROS = 100
-JLZEROS = bracket(JLZEROS_LMAX, JLZEROS_NZEROS, return_all=True)
+JLZEROS = _JlZeros(JLZEROS_LMAX, JLZEROS_NZEROS)
 
 ############################################################
 #                       Test
@@ -133,6 +236,44 @@ class _TestJlZeros(unittest.TestCase):
                             1e-14)
 
 
+    def test_jlzeros(self):
+        import tempfile
+        from unittest import mock
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch.dict(os.environ, {'SIAB_CACHE_DIR': tmpdir}):
+
+            # nothing is computed until the table is accessed
+            table = _JlZeros(3, 10)
+            self.assertIsNone(table._zeros)
+            self.assertFalse(os.path.exists(_jlzeros_cache_file()))
+
+            zeros = table[2]
+            self.assertEqual(len(zeros), 10)
+            self.assertLess(np.linalg.norm(spherical_jn(2, zeros), np.inf),
+                            1e-14)
+            self.assertTrue(os.path.exists(_jlzeros_cache_file()))
+
+            # a new table is loaded from the cache
+            with mock.patch(__name__ + '.bracket') as mock_bracket:
+                self.assertTrue(np.all(_JlZeros(3, 10)[3] == table[3]))
+                mock_bracket.assert_not_called()
+
+            # extends on demand
+            zeros = table[5]
+            self.assertEqual(len(table), 6)
+            self.assertLess(np.linalg.norm(spherical_jn(5, zeros), np.inf),
+                            1e-14)
+
+            table.extend(nzeros=30)
+            self.assertEqual(len(table[0]), 30)
+            self.assertTrue(np.allclose(table[0], np.pi * np.arange(1, 31)))
+
+            # the cache is never shrunk
+            self.assertEqual(np.load(_jlzeros_cache_file()).shape, (6, 30))
+            self.assertEqual(_JlZeros(1, 5)[0].shape, (30,))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.linalg import cho_solve
 
 def mrdiv(X, Y):
     '''
@@ -27,6 +28,62 @@ def mrdiv(X, Y):
             if len(X.shape) > 1 else np.linalg.solve(Y.T, X)
 
 
+def chol_factor(Y, rcond=1e-14):
+    '''
+    Factorization of a Hermitian positive-definite matrix for repeated
+    right divisions by chol_mrdiv.
+
+    Only a single matrix (possibly with leading dimensions of size 1,
+    e.g., gamma-only data) is factorized. For a stack of matrices, the
+    batched LU solves of mrdiv are as fast as per-slice Cholesky solves
+    (and faster than batched triangular solves via numpy), so Y itself
+    is kept. Y is kept as well if the Cholesky factorization fails or
+    indicates that Y is ill-conditioned (squared ratio between the
+    smallest and largest diagonal elements of the factor below rcond),
+    in which case chol_mrdiv falls back to the pivoted solve of mrdiv.
+
+    Returns
+    -------
+        A tuple (L, is_chol) where L is the lower-triangular Cholesky
+        factor (of the same shape as Y) if is_chol is True, or Y itself
+        otherwise.
+
+    '''
+    if Y.size != Y.shape[-1]**2:
+        return Y, False
+
+    try:
+        L = np.linalg.cholesky(Y.reshape(Y.shape[-2:]))
+    except np.linalg.LinAlgError:
+        return Y, False
+
+    d = np.abs(np.diag(L))
+    if d.min()**2 < rcond * d.max()**2:
+        return Y, False
+
+    return L.reshape(Y.shape), True
+
+
+def chol_mrdiv(X, F):
+    '''
+    Right matrix division X @ inv(Y) where F = chol_factor(Y).
+
+    X must have at least 2 dimensions. The leading dimensions of X and Y
+    must be broadcastable as in mrdiv.
+
+    '''
+    L, is_chol = F
+    if not is_chol:
+        return mrdiv(X, L)
+
+    # X @ inv(Y) = (inv(Y) @ X^H)^H for Hermitian Y; all rows of X are
+    # solved as one stacked RHS
+    shape = np.broadcast_shapes(X.shape[:-2], L.shape[:-2]) + X.shape[-2:]
+    Z = cho_solve((L.reshape(L.shape[-2:]), True),
+                  X.reshape(-1, X.shape[-1]).T.conj())
+    return Z.T.conj().reshape(shape)
+
+
 def rfrob(X, Y, rowwise=False):
     '''
     Real part of the Frobenius inner product.
@@ -89,6 +146,42 @@ class _TestLinalgHelper(unittest.TestCase):
                                         X @ Y[k].T.conj()))
 
 
+    def test_chol_mrdiv(self):
+        nk = 3
+        m = 5
+        n = 6
+
+        X = np.random.randn(nk, m, n) + 1j * np.random.randn(nk, m, n)
+        A = np.random.randn(nk, n, n) + 1j * np.random.randn(nk, n, n)
+        Y = A @ A.transpose((0,2,1)).conj() + np.eye(n)
+
+        # a stack is not factorized
+        F = chol_factor(Y)
+        self.assertFalse(F[1])
+        self.assertTrue(np.array_equal(chol_mrdiv(X, F), mrdiv(X, Y)))
+
+        # a single slice
+        F = chol_factor(Y[0])
+        self.assertTrue(F[1])
+        self.assertTrue(np.allclose(chol_mrdiv(X, F), mrdiv(X, Y[0])))
+        F = chol_factor(Y[:1])
+        self.assertTrue(F[1])
+        self.assertTrue(np.allclose(chol_mrdiv(X, F), mrdiv(X, Y[:1])))
+        self.assertTrue(np.allclose(chol_mrdiv(X[0], F), mrdiv(X[0], Y[:1])))
+
+        # falls back to mrdiv if ill-conditioned
+        Y[1] = np.diag([1] + [1e-15] * (n-1))
+        F = chol_factor(Y[1])
+        self.assertFalse(F[1])
+        self.assertTrue(np.array_equal(chol_mrdiv(X, F), mrdiv(X, Y[1])))
+
+        # falls back to mrdiv if not positive-definite
+        Y[1] = -np.eye(n)
+        F = chol_factor(Y[1])
+        self.assertFalse(F[1])
+        self.assertTrue(np.array_equal(chol_mrdiv(X, F), mrdiv(X, Y[1])))
+
+
     def test_rfrob(self):
         nk = 5
         m = 3
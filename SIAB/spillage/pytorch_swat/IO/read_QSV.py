@@ -1,4 +1,5 @@
 import SIAB.spillage.pytorch_swat.util as util
+from SIAB.spillage.datparse import read_orb_mat_index
 import torch
 import itertools
 import numpy as np
@@ -76,32 +77,29 @@ will read both orb_matrix*.dat of both order 0 and 1.""", flush=True)
     ovlp_Q, ovlp_Sq, ovlp_V = [], [], []
     istru = 0 # this is actually a flattened 2D index, row index is the structure index, column index is the k-point index
     for ifm, fmatrix in enumerate(fmatrices):
-        with open(fmatrix, "r") as file:
-            nkpts = int(re.compile(r"(\d+)\s+nks").search(file.read()).group(1))
-        with open(fmatrix, "r") as file:
-            data = re.compile(r"<OVERLAP_Q>(.+)</OVERLAP_Q>", re.S).search(file.read())
-            if not data:
-                raise ValueError(f"BROKEN FILE: No <OVERLAP_Q> found in file: {fmatrix}. Seems ABACUS calculation is not finished properly.")
-            data = map(float, data.group(1).split())
+        # section offsets are found in one scan and cached (see datparse),
+        # then each section is read (only once) by seeking to it
+        sections = read_orb_mat_index(fmatrix)
+        with open(fmatrix, "rb") as file:
+            data = read_section(file, sections, "OVERLAP_Q")
+            # the header is everything before <OVERLAP_Q>
+            file.seek(0)
+            nkpts = int(re.compile(rb"(\d+)\s+nks").search(file.read(sections["OVERLAP_Q"][0])).group(1))
+            ioff = 0
             for ikpt in range(nkpts):
-                qi = read_QI(stru_objs[istru+ikpt], element, data)
+                qi = read_QI(stru_objs[istru+ikpt], element, data[ioff:])
+                ioff += size_QI(stru_objs[istru+ikpt], element)
                 ovlp_Q.append(qi)
-        with open(fmatrix, "r") as file:
-            data = re.compile(r"<OVERLAP_Sq>(.+)</OVERLAP_Sq>", re.S).search(file.read())
-            if not data:
-                raise ValueError(f"BROKEN FILE: No <OVERLAP_Sq> found in file: {fmatrix}. Seems ABACUS calculation is not finished properly.")
-            data = map(float, data.group(1).split())
+            data = read_section(file, sections, "OVERLAP_Sq")
+            ioff = 0
             for ikpt in range(nkpts):
-                si = read_SI(stru_objs[istru+ikpt], element, data)
+                si = read_SI(stru_objs[istru+ikpt], element, data[ioff:])
+                ioff += size_SI(stru_objs[istru+ikpt], element)
                 ovlp_Sq.append(si)
-        if V_info["init_from_file"]:
-            with open(fmatrix, "r") as file:
-                data = re.compile(r"<OVERLAP_V>(.+)</OVERLAP_V>", re.S).search(file.read())
-                if not data:
-                    raise ValueError(f"BROKEN FILE: No <OVERLAP_V> found in file: {fmatrix}. Seems ABACUS calculation is not finished properly.")
-                data = map(float, data.group(1).split())
-        else:
-            data = ()
+            if V_info["init_from_file"]:
+                data = iter(read_section(file, sections, "OVERLAP_V").tolist())
+            else:
+                data = ()
         for ikpt in range(nkpts):
             vi = read_VI(stru_objs[istru+ikpt], V_info, ifm, data)
             ovlp_V.append(vi)
@@ -109,49 +107,105 @@ will read both orb_matrix*.dat of both order 0 and 1.""", flush=True)
     return ovlp_Q, ovlp_Sq, ovlp_V
 
 
+def read_section(file, sections, tag):
+    """all floats of the section `tag` of an opened (binary) orb_matrix file,
+    sections being the index returned by datparse.read_orb_mat_index"""
+    if tag not in sections:
+        raise ValueError(f"BROKEN FILE: No <{tag}> found in file: {file.name}. Seems ABACUS calculation is not finished properly.")
+    start, end = sections[tag]
+    file.seek(start)
+    return np.fromstring(file.read(end - start), sep=" ")
+
+
+def _as_block(data, count):
+    """the next `count` floats of data as an ndarray. data is either an ndarray
+    (returned as is, the caller takes care of the offset) or an iterator of
+    floats (consumed, for compatibility with the element-wise readers)"""
+    if isinstance(data, np.ndarray):
+        block = data[:count]
+    else:
+        block = np.fromiter(itertools.islice(data, count), dtype=np.float64)
+    if block.size < count:
+        raise ValueError(f"BROKEN FILE: {count} floats expected but only {block.size} found. "
+                         "Seems ABACUS calculation is not finished properly.")
+    return block
+
+
+def size_QI(info_stru, info_element):
+    """number of floats (real and imaginary parts) of one k-point in <OVERLAP_Q>"""
+    return 2 * info_stru.Nb * sum(info_stru.Na[it] * _nlm(info_element[it]) * info_element[it].Ne
+                                  for it in info_stru.Na.keys())
+
+
+def size_SI(info_stru, info_element):
+    """number of floats (real and imaginary parts) of one k-point in <OVERLAP_Sq>"""
+    n = [info_stru.Na[it] * _nlm(info_element[it]) * info_element[it].Ne for it in info_stru.Na.keys()]
+    return 2 * sum(n)**2
+
+
+def _nlm(info_element_it):
+    """number of (il, im) pairs of an element"""
+    return sum(util.Nm(il) for il in range(info_element_it.Nl))
+
+
 def read_QI(info_stru, info_element, data):
-    """ QI[it][il][ib*ia*im,ie]    <\psi|jY> """
+    """ QI[it][il][ib*ia*im,ie]    <\psi|jY>
+    data is the flattened (ib, it, ia, il, im, ie, re/im) block of one k-point,
+    either as an ndarray or an iterator of floats"""
+    its = list(info_stru.Na.keys())
+    # columns of each ib: (it, ia, il, im, ie)
+    ncol = [info_stru.Na[it] * _nlm(info_element[it]) * info_element[it].Ne for it in its]
+    block = _as_block(data, 2 * info_stru.Nb * sum(ncol)).view(np.complex128)
+    block = block.reshape(info_stru.Nb, sum(ncol))[:info_stru.Nb_true]
+
     QI = dict()
-    for it in info_stru.Na.keys():
-        QI[it] = util.ND_list(info_element[it].Nl)
-        for il in range(info_element[it].Nl):
-            QI[it][il] = torch.zeros((info_stru.Nb, info_stru.Na[it], util.Nm(il), info_element[it].Ne), dtype=torch.complex128)
-    for ib in range(info_stru.Nb):
-        for it in info_stru.Na.keys():
-            for ia in range(info_stru.Na[it]):
-                for il in range(info_element[it].Nl):
-                    for im in range(util.Nm(il)):
-                        for ie in range(info_element[it].Ne):
-                            QI[it][il][ib,ia,im,ie] = complex(next(data), next(data))
-    for it in info_stru.Na.keys():
-        for il in range(info_element[it].Nl):
-            QI[it][il] = QI[it][il][:info_stru.Nb_true,:,:,:].view(-1,info_element[it].Ne).conj()
+    for it, icol in zip(its, itertools.accumulate([0] + ncol)):
+        Nl, Ne = info_element[it].Nl, info_element[it].Ne
+        QI[it] = util.ND_list(Nl)
+        Q_t = block[:, icol:icol+info_stru.Na[it]*_nlm(info_element[it])*Ne]
+        Q_t = Q_t.reshape(info_stru.Nb_true, info_stru.Na[it], -1)
+        im = 0
+        for il in range(Nl):
+            Q_tl = Q_t[:, :, im*Ne:(im+util.Nm(il))*Ne]
+            # conj makes the only (contiguous) copy
+            QI[it][il] = torch.from_numpy(np.conj(Q_tl).reshape(-1, Ne))
+            im += util.Nm(il)
     return QI
 
 
 def read_SI(info_stru, info_element, data):
-    """ SI[it1,it2][il1][il2][ie1,ia1,im1,ia2,im2,ie2]    <jY|jY> """
+    """ SI[it1,it2][il1][il2][ie1,ia1,im1,ia2,im2,ie2]    <jY|jY>
+    data is the flattened (it1, ia1, il1, im1, it2, ia2, il2, im2, ie1, ie2, re/im)
+    block of one k-point, either as an ndarray or an iterator of floats"""
+    its = list(info_stru.Na.keys())
+    # number of (ia, il, im) rows of each type
+    nrow = {it: info_stru.Na[it] * _nlm(info_element[it]) for it in its}
+    ne = {it: info_element[it].Ne for it in its}
+    # columns of each row of it1: (it2, ia2, il2, im2, ie1, ie2)
+    ncol = {it1: sum(nrow[it2] * ne[it1] * ne[it2] for it2 in its) for it1 in its}
+    block = _as_block(data, 2 * sum(nrow[it] * ncol[it] for it in its)).view(np.complex128)
+
+    # offset of il in the (il, im) index
+    im0 = lambda il: sum(util.Nm(jl) for jl in range(il))
+
     SI = dict()
-    for it1,it2 in itertools.product( info_stru.Na.keys(), info_stru.Na.keys() ):
-        SI[it1,it2] = util.ND_list(info_element[it1].Nl, info_element[it2].Nl)
-        for il1,il2 in itertools.product( range(info_element[it1].Nl), range(info_element[it2].Nl) ):
-            SI[it1,it2][il1][il2] = torch.zeros((info_stru.Na[it1], util.Nm(il1), info_element[it1].Ne, info_stru.Na[it2], util.Nm(il2), info_element[it2].Ne), dtype=torch.complex128)
-    for it1 in info_stru.Na.keys():
-        for ia1 in range(info_stru.Na[it1]):
-            for il1 in range(info_element[it1].Nl):
-                for im1 in range(util.Nm(il1)):
-                    for it2 in info_stru.Na.keys():
-                        for ia2 in range(info_stru.Na[it2]):
-                            for il2 in range(info_element[it2].Nl):
-                                for im2 in range(util.Nm(il2)):
-                                    for ie1 in range(info_element[it1].Ne):
-                                        for ie2 in range(info_element[it2].Ne):
-                                            SI[it1,it2][il1][il2][ia1,im1,ie1,ia2,im2,ie2] = complex(next(data), next(data))
-#    for it1,it2 in itertools.product( info.Nt[ist], info.Nt[ist] ):
-#        for il1,il2 in itertools.product( range(info.Nl[it1]), range(info.Nl[it2]) ):    
-#            SI[it1,it2][il1][il2] = torch_complex.ComplexTensor(
-#                torch.from_numpy(SI[it1,it2][il1][il2].real),
-#                torch.from_numpy(SI[it1,it2][il1][il2].imag))
+    ioff = 0
+    for it1 in its:
+        S_1 = block[ioff:ioff+nrow[it1]*ncol[it1]].reshape(info_stru.Na[it1], -1, ncol[it1])
+        ioff += nrow[it1] * ncol[it1]
+        icol = 0
+        for it2 in its:
+            n12 = nrow[it2] * ne[it1] * ne[it2]
+            S_12 = S_1[:, :, icol:icol+n12].reshape(info_stru.Na[it1], -1, info_stru.Na[it2],
+                                                    _nlm(info_element[it2]), ne[it1], ne[it2])
+            # -> (ia1, [il1,im1], ie1, ia2, [il2,im2], ie2)
+            S_12 = S_12.transpose(0, 1, 4, 2, 3, 5)
+            icol += n12
+            SI[it1,it2] = util.ND_list(info_element[it1].Nl, info_element[it2].Nl)
+            for il1, il2 in itertools.product(range(info_element[it1].Nl), range(info_element[it2].Nl)):
+                m1, m2 = im0(il1), im0(il2)
+                SI[it1,it2][il1][il2] = torch.from_numpy(np.ascontiguousarray(
+                    S_12[:, m1:m1+util.Nm(il1), :, :, m2:m2+util.Nm(il2), :]))
     return SI
 
 
@@ -176,3 +230,60 @@ def read_VI(info_stru,V_info,ist,data):
         else:
             VI = np.eye(info_stru.Nb_true, info_stru.Nb_true, dtype=np.float64)
     return torch.from_numpy(VI)
+
+import unittest
+class TestReadQSV(unittest.TestCase):
+
+    def setUp(self):
+        import addict
+        self.info_stru = addict.Dict(Na={"C": 2, "O": 1}, Nb=5, Nb_true=4)
+        self.info_element = addict.Dict(C={"Nl": 2, "Ne": 3}, O={"Nl": 3, "Ne": 2})
+
+    def test_read_QI(self):
+        info_stru, info_element = self.info_stru, self.info_element
+        data = np.random.randn(size_QI(info_stru, info_element))
+        QI = read_QI(info_stru, info_element, data)
+        self.assertTrue(torch.equal(QI["C"][0], read_QI(info_stru, info_element, iter(data))["C"][0]))
+
+        # element-wise, in the order of the file
+        z = iter(data[0::2] + 1j * data[1::2])
+        for ib in range(info_stru.Nb):
+            for it in info_stru.Na.keys():
+                Ne = info_element[it].Ne
+                for ia in range(info_stru.Na[it]):
+                    for il in range(info_element[it].Nl):
+                        Q = QI[it][il].view(info_stru.Nb_true, info_stru.Na[it], util.Nm(il), Ne)
+                        for im, ie in itertools.product(range(util.Nm(il)), range(Ne)):
+                            ref = next(z)
+                            if ib < info_stru.Nb_true:
+                                self.assertEqual(Q[ib,ia,im,ie].item(), ref.conjugate())
+
+    def test_read_SI(self):
+        info_stru, info_element = self.info_stru, self.info_element
+        data = np.random.randn(size_SI(info_stru, info_element))
+        SI = read_SI(info_stru, info_element, data)
+
+        z = iter(data[0::2] + 1j * data[1::2])
+        its = list(info_stru.Na.keys())
+        for it1 in its:
+            for ia1, il1 in itertools.product(range(info_stru.Na[it1]), range(info_element[it1].Nl)):
+                for im1 in range(util.Nm(il1)):
+                    for it2 in its:
+                        for ia2, il2 in itertools.product(range(info_stru.Na[it2]), range(info_element[it2].Nl)):
+                            for im2 in range(util.Nm(il2)):
+                                for ie1, ie2 in itertools.product(range(info_element[it1].Ne), range(info_element[it2].Ne)):
+                                    self.assertEqual(SI[it1,it2][il1][il2][ia1,im1,ie1,ia2,im2,ie2].item(), next(z))
+                                self.assertTrue(SI[it1,it2][il1][il2].is_contiguous())
+
+    def test_truncated(self):
+        info_stru, info_element = self.info_stru, self.info_element
+        for read, size in [(read_QI, size_QI), (read_SI, size_SI)]:
+            data = np.random.randn(size(info_stru, info_element) - 2)
+            with self.assertRaises(ValueError):
+                read(info_stru, info_element, data)
+            with self.assertRaises(ValueError):
+                read(info_stru, info_element, iter(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,7 @@ import SIAB.spillage.pytorch_swat.IO.print_orbital as sspsipo
 import SIAB.spillage.pytorch_swat.IO.change_info as sspsicinfo
 import SIAB.spillage.pytorch_swat.IO.cal_weight as sspsicw
 from SIAB.spillage.pytorch_swat.opt_orbital import Opt_Orbital
-from SIAB.spillage.pytorch_swat.opt_orbital_wavefunc import Opt_Orbital_Wavefunc
+from SIAB.spillage.pytorch_swat.opt_orbital_wavefunc import Opt_Orbital_Spillage
 import SIAB.spillage.pytorch_swat.orbital as sspso
 import SIAB.spillage.pytorch_swat.util as sspsu
 # released/official packages
@@ -25,6 +25,19 @@ def main(params: dict = None):
     """not-highly abstracted main function, as workflow function of spillage optimiaztion task"""
     coef_deriv0, coef_deriv1 = params.get("spill_coefs", [2, 1])
     spill_thr = params.get("spill_thr", 1e-8)
+    # batched Q/S kernels (Opt_Orbital_Batch), False falls back to the per-block Opt_Orbital ones
+    spill_batch = params.get("spill_batch", True)
+    # torch.compile the per-structure spillage evaluators (CPU), off by default
+    spill_compile = params.get("spill_compile", False)
+    # stopping policy, see sspsu.Convergence: spill_thr (absolute) and spill_rel_thr (relative) are
+    # thresholds of the improvement of the loss within spill_window steps, below either of which the
+    # optimization is considered converged
+    spill_rel_thr = params.get("spill_rel_thr", 1e-8)
+    spill_patience = params.get("spill_patience", 50)
+    spill_window = params.get("spill_window", 100)
+    spill_grad_thr = params.get("spill_grad_thr", 1e-10)
+    # optional learning rate decay (factor) on plateaus, None to keep the learning rate fixed
+    spill_lr_decay = params.get("spill_lr_decay", None)
     print("""
 --------------------------------------------------
 Module Spillage - find the most similar space to the target spanned planewave wavefunction:
@@ -156,6 +169,19 @@ Max steps: {info_opt.max_steps}
 """, flush=True)
 
     orb_optimizer = torch_optimizer.SWATS(sum(C.values(),[]), lr=info_opt.lr, eps=1e-20)
+    # spillage evaluator of each structure, everything not depending on C is prepared here once:
+    # static (padded and permuted) QI/SI operands and index maps, weights sliced to Nb_true, update0(VI)
+    # linear corresponds to the mode of calculating the derivative of the wavefunction
+    spillage_stru = [ Opt_Orbital_Spillage(info_stru[ist], info_element, V_info, weight[ist],
+                                           (QI[ist], SI[ist], VI_origin[ist]),
+                                           [ (QI_linear[i][ist], SI_linear[i][ist], VI_linear[i][ist])
+                                             for i in range(len(file_list.get("linear", []))) ],
+                                           coef_deriv=(coef_deriv0, coef_deriv1), batch=spill_batch)
+                      for ist in range(len(info_stru)) ]
+    if spill_compile:
+        # trace the evaluators to reduce the Python overhead of each step, falls back to eager mode
+        # on graph breaks (e.g. complex operators not supported by the compiler)
+        spillage_stru = [ torch.compile(f, dynamic=False) for f in spillage_stru ]
     with open(fspill, "w") as S_file:
         
         print("Optimization on Spillage function starts, check \"Spillage.dat\" for detailed trajectory.", flush=True)
@@ -183,44 +209,31 @@ Max steps: {info_opt.max_steps}
                 maxSteps = info_opt.max_steps
         # spillage value of the previous step, initialize as 0.
         _spill_0 = 0
+        convergence = sspsu.Convergence(patience=spill_patience, window=spill_window,
+                                        rel_thr=spill_rel_thr, grad_thr=spill_grad_thr,
+                                        abs_thr=spill_thr)
+        stop_reason = None
+        if spill_lr_decay is not None:
+            lr_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(orb_optimizer, factor=spill_lr_decay,
+                                                                      patience=max(spill_patience//5, 1))
         
 		###################################
 		#    OPTIMIZATION LOOP STARTS     #
 		###################################
         # optimization loop starts here
+        time_loopstart = time.time()
+        istep = -1 # in case of no step at all
         for istep in range(maxSteps):
             # record the time of each step
             time_stepstart = time.time()
             # --------------------------------
             # START: hack function here to change definition of Spillage
+            # (see Opt_Orbital_Spillage, one can modifiy the mixing coefficients between the two terms
+            # psi and dpsi there)
             Spillage = 0
             # for each structure...
-            for ist in range(len(info_stru)):
-                # initialize a new Opt_Orbital_Wavefunc object for STRU
-                opt_orb_wave = Opt_Orbital_Wavefunc(info_stru[ist], info_element, V_info)
-                # 
-                V_origin = opt_orb_wave.cal_V_origin(C, QI[ist], SI[ist])
-                # linear corresponds to the mode of calculating the derivative of the wavefunction
-                if "linear" in file_list.keys():
-                    V_linear = [ opt_orb_wave.cal_V_linear(C, QI_linear[i][ist], SI_linear[i][ist])
-                        for i in range(len(file_list["linear"]))]
-                # why defines the spillage function here and not outside the loop?
-                def cal_Spillage(V_delta):
-                    Spillage = (V_delta * weight[ist][:info_stru[ist].Nb_true]).sum()
-                    return Spillage
-				# why defines the delta function here and not outside the loop?
-                def cal_delta(VI, V):
-                    return ((VI[ist]-V)/sspsu.update0(VI[ist])).abs()        # abs or **2?
-                # central expression appears to be here, one can modifiy the mixing coefficients between the two terms
-                # psi and dpsi here.
-                # CALCULATE THE SPILLAGE
-                s0 = cal_Spillage(cal_delta(VI_origin, V_origin))
-                Spillage += coef_deriv0*s0
-				# append the linear term to the spillage if the linear term is defined
-                if "linear" in file_list.keys():
-                    for i in range(len(file_list["linear"])):
-                        s1 = cal_Spillage(cal_delta(VI_linear[i], V_linear[i]))
-                        Spillage += coef_deriv1*s1
+            for spillage_ist in spillage_stru:
+                Spillage = spillage_ist(C, Spillage)
             # END: hack function here to change definition of Spillage
             # --------------------------------
             # kinetic energy term contribution
@@ -244,35 +257,34 @@ Max steps: {info_opt.max_steps}
                 if not istep % 100:
                     print(f"{istep:>10}{Spillage.item():>20.10e}{_dspill:>20.10e}{duration:>10.4f}", flush=True)
                     
-            flag_finish = 0
             if Loss.item() < loss_old:
                 loss_old = Loss.item()
                 C_old = sspsifc.copy_C(C, info_element)
-                flag_finish = 0
-            else:
-                flag_finish += 1
-                if flag_finish > 50:
-                    break
 
             orb_optimizer.zero_grad()
             Loss.backward()        
             if C_init_info["init_from_file"] and not C_init_info["opt_C_read"]:
                 for it, il, iu in C_read_index:
                     C[it][il].grad[:, iu] = 0
+            grad_norm = torch.sqrt(sum((c.grad**2).sum() for c in sum(C.values(), []))).item()
+            stop_reason = convergence.update(Loss.item(), grad_norm)
+            if stop_reason is not None:
+                break
             orb_optimizer.step()
+            if spill_lr_decay is not None:
+                lr_scheduler.step(Loss.item())
             #orbital.normalize(
             #    orbital.generate_orbital(info_element, C, E),
             #    {it:info_element[it].dr for it in info_element},
             #    C, flag_norm_C=True)
             
-            # add the convergence condition here, while for old version the optimization
-            # will proceed until the max step is reached. However observed that the optimization
-            # will converge in a few steps.
-            # if abs(_dspill) <= spill_thr:
-            #     print(f"...\nSpillage meets convergence threshold {spill_thr} ({abs(_dspill)}) at step {istep}.", flush=True)
-            #     break
-            # if istep == maxSteps-1:
-            #     print(f"...\nWARNING: Spillage optimization reaches the maximum steps {maxSteps} without convergence ({spill_thr}).", flush=True)
+        if stop_reason is not None:
+            print(f"...\nSpillage optimization stops at step {istep}: {stop_reason} "
+                  f"({maxSteps-istep-1} of {maxSteps} steps saved).", flush=True)
+        else:
+            print(f"...\nWARNING: Spillage optimization reaches the maximum steps {maxSteps} without convergence ({spill_thr}).", flush=True)
+        print(f"Average time per step ({'batched' if spill_batch else 'per-block'} Q/S kernels): "
+              f"{(time.time()-time_loopstart)/max(istep+1, 1):.4e} s", flush=True)
 
     orb = sspso.generate_orbital(info_element, C_old, E)
     # this is a ad hoc way to smooth the orbital. A more clean way would be implemented
@@ -179,4 +179,149 @@ class Opt_Orbital:
                     T = T + T_tlu/Z_tlu
                 num += C_tl.size()[1]
         T = 0.5 * T / num
-        return T
\ No newline at end of file
+        return T
+
+
+class Opt_Orbital_Batch:
+    """
+      batched version of Opt_Orbital.cal_Q + change_index_Q and Opt_Orbital.cal_S + change_index_S
+      for one structure: QI and SI are zero-padded to a uniform (ia, ilm, ie) layout (all types
+      together) once, then each step contracts them with the coefficients by batched matrix
+      products (batched over the (ia, ilm) rows) and picks the (it, il, ia, im, iu) order by
+      static index maps. Since C is real, the real and imaginary parts of QI and SI are stored
+      as separate rows of real tensors, so that the products (and their backward) are real
+    """
+
+    def __init__(self, QI, SI, info_stru, info_element):
+        """
+          QI[it][il][ib*ia*im,ie]
+          SI[it1,it2][il1][il2][ia1,im1,ie1,ia2,im2,ie2]
+        """
+        self.its = list(info_stru.Na.keys())
+        self.Nb = info_stru.Nb_true
+        self.info_element = info_element
+        Nlm = {it: sum(util.Nm(il) for il in range(info_element[it].Nl)) for it in self.its}
+        # offset of il in the (il, im) index
+        lm0 = {it: [sum(util.Nm(jl) for jl in range(il)) for il in range(info_element[it].Nl)] for it in self.its}
+        # first atom of each type in the (ia) index of all types
+        ia0 = dict(zip(self.its, itertools.accumulate([0] + [info_stru.Na[it] for it in self.its])))
+        self.Na = sum(info_stru.Na.values())
+        self.Nlm = max(Nlm.values())
+        self.Ne = max(info_element[it].Ne for it in self.its)
+        self.Nu = max(max(info_element[it].Nu, default=0) for it in self.its)
+
+        # (it, il) of each padded (ia, ilm) row; padded rows point to the last (zero) entry
+        self.tl = [(it, il) for it in self.its for il in range(info_element[it].Nl)]
+        tl_index = torch.full((self.Na, self.Nlm), len(self.tl), dtype=torch.long)
+        # index[it*il*ia*im*iu] of the padded (ia, ilm, iu)
+        index = []
+        for it in self.its:
+            for il in range(info_element[it].Nl):
+                itl = self.tl.index((it, il))
+                for ia in range(ia0[it], ia0[it]+info_stru.Na[it]):
+                    tl_index[ia, lm0[it][il]:lm0[it][il]+util.Nm(il)] = itl
+                    for im in range(util.Nm(il)):
+                        for iu in range(info_element[it].Nu[il]):
+                            index.append((ia*self.Nlm + lm0[it][il]+im)*self.Nu + iu)
+        self.tl_index = tl_index
+        self.index = torch.tensor(index, dtype=torch.long)
+
+        # QI_pad[ia,ilm,ib,ie], batch index first
+        self.QI = torch.zeros((self.Na, self.Nlm, self.Nb, self.Ne), dtype=torch.complex128)
+        for it in self.its:
+            Ne = info_element[it].Ne
+            for il in range(info_element[it].Nl):
+                self.QI[ia0[it]:ia0[it]+info_stru.Na[it], lm0[it][il]:lm0[it][il]+util.Nm(il), :, :Ne] \
+                    = QI[it][il].view(self.Nb, info_stru.Na[it], util.Nm(il), Ne).permute(1, 2, 0, 3)
+        # QI_pad[ia*ilm,ib*re/im,ie]
+        self.QI = torch.view_as_real(self.QI).transpose(-1, -2).reshape(self.Na*self.Nlm, -1, self.Ne)
+
+        # SI_pad[ia2,ilm2,ia1,ilm1,ie1,ie2], batch index first
+        self.SI = torch.zeros((self.Na, self.Nlm)*2 + (self.Ne,)*2, dtype=torch.complex128)
+        for it1, it2 in itertools.product(self.its, self.its):
+            Na1, Na2, Ne1, Ne2 = info_stru.Na[it1], info_stru.Na[it2], info_element[it1].Ne, info_element[it2].Ne
+            for il1, il2 in itertools.product(range(info_element[it1].Nl), range(info_element[it2].Nl)):
+                self.SI[ia0[it2]:ia0[it2]+Na2, lm0[it2][il2]:lm0[it2][il2]+util.Nm(il2),
+                        ia0[it1]:ia0[it1]+Na1, lm0[it1][il1]:lm0[it1][il1]+util.Nm(il1), :Ne1, :Ne2] \
+                    = SI[it1,it2][il1][il2].permute(3, 4, 0, 1, 2, 5)
+        # SI_pad[ia2*ilm2,ia1*ilm1*ie1*re/im,ie2]
+        self.SI = torch.view_as_real(self.SI).transpose(-1, -2).reshape(self.Na*self.Nlm, -1, self.Ne)
+
+
+    def C_rows(self, C):
+        """
+          C_rows[ia,ilm,ie,iu] = C[it][il][ie,iu], zero-padded
+        """
+        C_pad = [ torch.nn.functional.pad(C[it][il], (0, self.Nu-C[it][il].shape[1], 0, self.Ne-C[it][il].shape[0]))
+                  for it, il in self.tl ]
+        C_pad.append( torch.zeros((self.Ne, self.Nu), dtype=torch.float64) )
+        return torch.stack(C_pad)[self.tl_index]
+
+
+    def cal_Q(self, C, C_rows=None):
+        """
+          Q_cat[ib,it*il*ia*im*iu]
+              = sum_{ie} QI[it][il][ib*ia*im,ie] * C[it][il][ie,iu]
+        """
+        if C_rows is None:
+            C_rows = self.C_rows(C)
+        # Q[ia*ilm,ib,re/im,iu] -> [ib,ia*ilm*iu]
+        Q = torch.bmm(self.QI, C_rows.view(-1, self.Ne, self.Nu)).view(-1, self.Nb, 2, self.Nu)
+        Q = torch.view_as_complex(Q.permute(1, 0, 3, 2).contiguous()).view(self.Nb, -1)
+        return Q.index_select(1, self.index)
+
+
+    def cal_S(self, C, C_rows=None):
+        """
+          S_cat[it1*il1*ia1*im1*iu1,it2*il2*ia2*im2*iu2]
+              = sum_{ie1 ie2} C^*[it1][il1][ie1,iu1] * SI[it1,it2][il1][il2][ia1,im1,ie1,ia2,im2,ie2] * C[it2][[il2][ie2,iu2]
+        """
+        if C_rows is None:
+            C_rows = self.C_rows(C)
+        C_rows = C_rows.view(-1, self.Ne, self.Nu)
+        n = self.Na * self.Nlm
+        # SI_C[ia2*ilm2,ia1*ilm1*ie1*re/im,iu2] -> [ia1*ilm1,ie1,ia2*ilm2*iu2*re/im]
+        SI_C = torch.bmm(self.SI, C_rows)
+        SI_C = SI_C.view(n, n, self.Ne, 2, self.Nu).permute(1, 2, 0, 4, 3).reshape(n, self.Ne, -1)
+        # C_SI_C[ia1*ilm1,iu1,ia2*ilm2*iu2*re/im]
+        C_SI_C = torch.bmm(C_rows.transpose(1, 2), SI_C)
+        C_SI_C = torch.view_as_complex(C_SI_C.view(n*self.Nu, -1, 2))
+        return C_SI_C.index_select(0, self.index).index_select(1, self.index)
+
+
+import unittest
+class TestOptOrbitalBatch(unittest.TestCase):
+
+    def test_batch(self):
+        import addict
+        torch.manual_seed(0)
+        # two types with different Nl, Ne and a zero Nu
+        info_stru = addict.Dict(Na={"C": 2, "O": 1}, Nb=5, Nb_true=3)
+        info_element = addict.Dict(C={"Nu": [2, 1], "Nl": 2, "Ne": 5}, O={"Nu": [3, 0, 1], "Nl": 3, "Ne": 4})
+        its = info_stru.Na.keys()
+        QI = { it: [ torch.randn(info_stru.Nb_true*info_stru.Na[it]*util.Nm(il), info_element[it].Ne, dtype=torch.complex128)
+                     for il in range(info_element[it].Nl) ] for it in its }
+        SI = { (it1,it2): [ [ torch.randn(info_stru.Na[it1], util.Nm(il1), info_element[it1].Ne,
+                                          info_stru.Na[it2], util.Nm(il2), info_element[it2].Ne, dtype=torch.complex128)
+                              for il2 in range(info_element[it2].Nl) ] for il1 in range(info_element[it1].Nl) ]
+               for it1, it2 in itertools.product(its, its) }
+        C = { it: [ torch.randn(info_element[it].Ne, Nu, dtype=torch.float64, requires_grad=True)
+                    for Nu in info_element[it].Nu ] for it in its }
+
+        Q_ref = Opt_Orbital.change_index_Q(Opt_Orbital.cal_Q(QI, C, info_stru, info_element), info_stru)
+        S_ref = Opt_Orbital.change_index_S(Opt_Orbital.cal_S(SI, C, info_stru, info_element), info_stru, info_element)
+        QS = Opt_Orbital_Batch(QI, SI, info_stru, info_element)
+        Q, S = QS.cal_Q(C), QS.cal_S(C)
+        self.assertTrue(torch.allclose(Q, Q_ref))
+        self.assertTrue(torch.allclose(S, S_ref))
+
+        # gradients w.r.t. C
+        C_all = sum(C.values(), [])
+        grad_ref = torch.autograd.grad((Q_ref.abs()**2).sum() + (S_ref.abs()**2).sum(), C_all)
+        grad = torch.autograd.grad((Q.abs()**2).sum() + (S.abs()**2).sum(), C_all)
+        for g, g_ref in zip(grad, grad_ref):
+            self.assertTrue(torch.allclose(g, g_ref))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,8 @@
 # DATE :   2022-10-03
 #=======================
 
-from SIAB.spillage.pytorch_swat.opt_orbital import Opt_Orbital
+from SIAB.spillage.pytorch_swat.opt_orbital import Opt_Orbital, Opt_Orbital_Batch
+import SIAB.spillage.pytorch_swat.util as util
 
 class Opt_Orbital_Wavefunc:
 
@@ -27,6 +28,16 @@ class Opt_Orbital_Wavefunc:
         S = Opt_Orbital.change_index_S(
             Opt_Orbital.cal_S( SI, C,self.info_stru, self.info_element ),
             self.info_stru, self.info_element)
+        return self._cal_V_origin(Q, S)
+
+    def cal_V_origin_batch(self, C, QS):
+        """
+            same as cal_V_origin, with QS an Opt_Orbital_Batch of (QI, SI)
+        """
+        C_rows = QS.C_rows(C)
+        return self._cal_V_origin(QS.cal_Q(C, C_rows), QS.cal_S(C, C_rows))
+
+    def _cal_V_origin(self, Q, S):
         self.coef = Opt_Orbital.cal_coef(Q, S)
         self.V = Opt_Orbital.cal_V(self.coef, Q)
         V_origin = Opt_Orbital.cal_V_origin(self.V, self.V_info)
@@ -46,5 +57,109 @@ class Opt_Orbital_Wavefunc:
         S_linear = Opt_Orbital.change_index_S(
             Opt_Orbital.cal_S( SI_linear, C, self.info_stru, self.info_element ),
             self.info_stru, self.info_element)
+        return self._cal_V_linear(Q_linear, S_linear)
+
+    # attention: must cal_V_origin() or cal_V_origin_batch() firstly
+    def cal_V_linear_batch(self, C, QS_linear):
+        """
+            same as cal_V_linear, with QS_linear an Opt_Orbital_Batch of (QI_linear, SI_linear)
+        """
+        C_rows = QS_linear.C_rows(C)
+        return self._cal_V_linear(QS_linear.cal_Q(C, C_rows), QS_linear.cal_S(C, C_rows))
+
+    def _cal_V_linear(self, Q_linear, S_linear):
         V_linear = Opt_Orbital.cal_V_linear( self.coef, Q_linear, S_linear, self.V, self.V_info )
         return V_linear
+
+
+
+class Opt_Orbital_Spillage:
+    """
+        Spillage of one structure as a function of C only. Everything else (the Opt_Orbital_Wavefunc
+        object, the (batched) QI/SI operands, weight sliced to Nb_true and the regularized VI) is
+        prepared once, so that an optimization step only evaluates the C-dependent part.
+    """
+
+    def __init__(self, info_stru, info_element, V_info, weight, QSV, QSV_linear=(), coef_deriv=(2, 1), batch=True):
+        """
+            weight[ib]  or  weight[ib1,ib2]
+            QSV = (QI, SI, VI), see Opt_Orbital_Wavefunc
+            QSV_linear[i] = (QI_linear, SI_linear, VI_linear)
+            coef_deriv: mixing coefficients of the spillage of psi and that of dpsi (linear)
+        """
+        self.wavefunc = Opt_Orbital_Wavefunc(info_stru, info_element, V_info)
+        self.batch = batch
+        self.coef_deriv0, self.coef_deriv1 = coef_deriv
+        self.weight = weight[:info_stru.Nb_true]
+        QS = lambda QI, SI: Opt_Orbital_Batch(QI, SI, info_stru, info_element) if batch else (QI, SI)
+        # (QI, SI) or the Opt_Orbital_Batch of them, and (VI, update0(VI)) for cal_delta
+        self.QS = QS(*QSV[:2])
+        self.VI = (QSV[2], util.update0(QSV[2]))
+        self.QS_linear = [ QS(*QSV_l[:2]) for QSV_l in QSV_linear ]
+        self.VI_linear = [ (QSV_l[2], util.update0(QSV_l[2])) for QSV_l in QSV_linear ]
+
+    def cal_Spillage(self, V_delta):
+        return (V_delta * self.weight).sum()
+
+    def cal_delta(self, VI, V):
+        return ((VI[0]-V)/VI[1]).abs()        # abs or **2?
+
+    def __call__(self, C, Spillage=0):
+        """
+            Spillage + coef_deriv0 * Spillage(psi) + coef_deriv1 * sum_i Spillage(dpsi_i)
+        """
+        if self.batch:
+            V_origin = self.wavefunc.cal_V_origin_batch(C, self.QS)
+            V_linear = [ self.wavefunc.cal_V_linear_batch(C, QS_l) for QS_l in self.QS_linear ]
+        else:
+            V_origin = self.wavefunc.cal_V_origin(C, *self.QS)
+            V_linear = [ self.wavefunc.cal_V_linear(C, *QS_l) for QS_l in self.QS_linear ]
+        Spillage = Spillage + self.coef_deriv0 * self.cal_Spillage(self.cal_delta(self.VI, V_origin))
+        for VI_l, V_l in zip(self.VI_linear, V_linear):
+            Spillage = Spillage + self.coef_deriv1 * self.cal_Spillage(self.cal_delta(VI_l, V_l))
+        return Spillage
+
+
+
+import unittest
+class TestOptOrbitalSpillage(unittest.TestCase):
+
+    def test_spillage(self):
+        import addict
+        import torch
+        torch.manual_seed(0)
+        info_stru = addict.Dict(Na={"Si": 2}, Nb=6, Nb_true=4)
+        info_element = addict.Dict(Si={"Nu": [2, 1], "Nl": 2, "Ne": 6})
+        V_info = {"same_band": True}
+        Na, Ne, Nl = 2, 6, 2
+        def QSV():
+            # S positive definite: S = X^H X
+            X = torch.randn(3*Na*Ne, Na, 4, Ne, dtype=torch.complex128)
+            X_l = [ X[:, :, :1, :], X[:, :, 1:, :] ]
+            SI = {("Si","Si"): [ [ torch.einsum("xaie,xAjf->aieAjf", X_l[il1].conj(), X_l[il2])
+                                   for il2 in range(Nl) ] for il1 in range(Nl) ]}
+            QI = {"Si": [ torch.randn(info_stru.Nb_true*Na*util.Nm(il), Ne, dtype=torch.complex128) for il in range(Nl) ]}
+            VI = torch.rand(info_stru.Nb_true, dtype=torch.float64) + 1
+            return QI, SI, VI
+        QSV_origin, QSV_linear = QSV(), QSV()
+        weight = torch.rand(info_stru.Nb)
+        C = {"Si": [ torch.randn(Ne, Nu, dtype=torch.float64, requires_grad=True) for Nu in info_element.Si.Nu ]}
+
+        # the per-step evaluation it replaces
+        wavefunc = Opt_Orbital_Wavefunc(info_stru, info_element, V_info)
+        V_origin = wavefunc.cal_V_origin(C, *QSV_origin[:2])
+        V_linear = wavefunc.cal_V_linear(C, *QSV_linear[:2])
+        cal_delta = lambda VI, V: ((VI-V)/util.update0(VI)).abs()
+        ref = 0.5 + 2 * (cal_delta(QSV_origin[2], V_origin) * weight[:info_stru.Nb_true]).sum()
+        ref = ref + 1 * (cal_delta(QSV_linear[2], V_linear) * weight[:info_stru.Nb_true]).sum()
+
+        for batch in [True, False]:
+            spillage = Opt_Orbital_Spillage(info_stru, info_element, V_info, weight,
+                                            QSV_origin, [QSV_linear], coef_deriv=(2, 1), batch=batch)
+            self.assertTrue(torch.allclose(spillage(C, 0.5), ref))
+            # evaluated again with the same (static) data
+            self.assertTrue(torch.allclose(spillage(C, 0.5), ref))
+
+
+if __name__ == "__main__":
+    unittest.main()
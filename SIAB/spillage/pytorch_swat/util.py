@@ -1,4 +1,5 @@
 import torch
+import collections
 import torch_complex
 
 def ND_list(*sizes,element=None):
@@ -42,4 +43,86 @@ def update0(t):
     return t.masked_fill(mask=(t==0), value=1E-10)
 
 def Nm(il):
-    return 2*il+1
\ No newline at end of file
+    return 2*il+1
+
+class Convergence:
+    """
+      stopping policy of the orbital optimization. update() is called once per step and returns
+      the reason to stop (str) or None
+        patience: stop if the best loss is not improved in so many steps
+        window, rel_thr: stop if the best loss is improved by less than rel_thr (relative) within
+                         the last window steps
+        grad_thr: stop if the norm of the gradient is below it
+        abs_thr: stop if the best loss is improved by no more than abs_thr (absolute) within the
+                 last window steps, None to disable
+    """
+    def __init__(self, patience=50, window=100, rel_thr=1E-8, grad_thr=1E-10, abs_thr=None):
+        self.patience = patience
+        self.window = window
+        self.rel_thr = rel_thr
+        self.grad_thr = grad_thr
+        self.abs_thr = abs_thr
+        # best loss of the last window+1 steps
+        self.best = collections.deque(maxlen=window+1)
+        self.nstale = 0
+
+    def update(self, loss, grad_norm=None):
+        if self.best and loss >= self.best[-1]:
+            self.nstale += 1
+            self.best.append(self.best[-1])
+        else:
+            self.nstale = 0
+            self.best.append(loss)
+
+        if self.nstale > self.patience:
+            return f"no improvement in {self.patience} steps"
+        if len(self.best) > self.window and self.best[0] - self.best[-1] <= self.rel_thr * abs(self.best[-1]):
+            return f"relative improvement below {self.rel_thr} in {self.window} steps"
+        if self.abs_thr is not None and len(self.best) > self.window and self.best[0] - self.best[-1] <= self.abs_thr:
+            return f"improvement below {self.abs_thr} in {self.window} steps"
+        if grad_norm is not None and grad_norm < self.grad_thr:
+            return f"gradient norm {grad_norm:.4e} below {self.grad_thr}"
+        return None
+
+
+import unittest
+class TestConvergence(unittest.TestCase):
+
+    def test_patience(self):
+        conv = Convergence(patience=3, window=100)
+        for loss in [1.0, 0.5, 0.6, 0.6, 0.7]:
+            self.assertIsNone(conv.update(loss))
+        # the 4th step without improvement
+        self.assertIsNotNone(conv.update(0.5))
+        # an improvement resets the counter
+        conv = Convergence(patience=3, window=100)
+        for loss in [1.0, 0.9, 0.9, 0.9, 0.8, 0.8, 0.8, 0.8]:
+            self.assertIsNone(conv.update(loss))
+
+    def test_window(self):
+        conv = Convergence(patience=100, window=5, rel_thr=1E-3)
+        reasons = [conv.update(1.0 * 0.9**i) for i in range(20)]
+        self.assertTrue(all(r is None for r in reasons))
+        # plateau: improvements of 1e-5 (relative) per step
+        reasons = [conv.update(0.1 - 1E-6 * i) for i in range(6)]
+        self.assertEqual(reasons[:-1], [None] * 5)
+        self.assertIsNotNone(reasons[-1])
+
+    def test_grad(self):
+        conv = Convergence(grad_thr=1E-6)
+        self.assertIsNone(conv.update(1.0, 1E-3))
+        self.assertIsNotNone(conv.update(0.9, 1E-7))
+
+    def test_abs(self):
+        conv = Convergence(patience=100, window=5, rel_thr=0, abs_thr=1E-8)
+        # a single step below the threshold does not stop the optimization
+        losses = [1.0, 0.9, 0.9 - 1E-9, 0.8, 0.7, 0.6, 0.5, 0.4]
+        self.assertTrue(all(conv.update(loss) is None for loss in losses))
+        # a plateau over the window does
+        reasons = [conv.update(0.4 - 1E-10 * i) for i in range(1, 6)]
+        self.assertEqual(reasons[:-1], [None] * 4)
+        self.assertIsNotNone(reasons[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -273,7 +273,8 @@ def _nbes(l, rcut, ecut):
 
     '''
     # make sure the tabulated zeros are sufficient
-    assert (JLZEROS[l][-1]/rcut)**2 > ecut
+    while (JLZEROS[l][-1]/rcut)**2 <= ecut:
+        JLZEROS.extend(lmax=l, nzeros=2*len(JLZEROS[l]))
     return sum((JLZEROS[l]/rcut)**2 < ecut)
 
 
@@ -468,6 +469,11 @@ class _TestRadial(unittest.TestCase):
             kin = simpson((-2 * r * df - r**2 * d2f + l*(l+1) * f) * f, x=r)
             self.assertLess(kin, ecut)
 
+        # the tabulated zeros are extended on demand for large cutoffs
+        # (zeros of j_0 are simply q*pi)
+        self.assertEqual(_nbes(0, 10.0, 2000.0),
+                         int(10.0 * np.sqrt(2000.0) / np.pi))
+
 
     def test_inner_prod(self):
         # checks inner_prod by verifying the orthogonality
@@ -16,27 +16,63 @@ Physical Review B, 103(23), 235131.
 from SIAB.spillage.radial import jl_reduce
 from SIAB.spillage.listmanip import flatten, nest, nestpat
 from SIAB.spillage.index import _lin2comp, perm_zeta_m, _nao
-from SIAB.spillage.linalg_helper import mrdiv, rfrob
-from SIAB.spillage.basistrans import jy2ao
+from SIAB.spillage.linalg_helper import mrdiv, rfrob, chol_factor, chol_mrdiv
+from SIAB.spillage.basistrans import jy2ao, BlockJy2ao, FlatCoef
+from SIAB.spillage.lcao_wfc_analysis import _wll
 from SIAB.spillage.datparse import read_orb_mat, \
         read_wfc_lcao_txt, read_triu, read_running_scf_log
 
+import os
+import functools
 import numpy as np
 from scipy.optimize import minimize
 from copy import deepcopy
+from collections import namedtuple
+from multiprocessing import shared_memory
 
 
-def _jy_data_extract(outdir):
+def _jy_data_files(outdir, calculation='scf', gamma_only=None):
+    '''
+    Files read by _jy_data_extract (see there for the parameters).
+
+    Returns the data of running_{calculation}.log, the (resolved)
+    gamma_only flag and a dict of file names with keys 'log', 'S', 'T'
+    (one file per k-point) and 'C' (one file per spin & k-point).
+
+    '''
+    log = f'{outdir}/running_{calculation}.log'
+    info = read_running_scf_log(log)
+
+    nk = len(info['wk'])
+    if gamma_only is None:
+        gamma_only = nk == 1
+    wfc_suffix = 'GAMMA' if gamma_only else 'K'
+
+    return info, gamma_only, {
+        'log': log,
+        'S': [f'{outdir}/data-{ik}-S' for ik in range(nk)],
+        'T': [f'{outdir}/data-{ik}-T' for ik in range(nk)],
+        'C': [f'{outdir}/WFC_NAO_{wfc_suffix}{isk+1}.txt'
+              for isk in range(info['nspin'] * nk)],
+        }
+
+
+def _jy_data_extract(outdir, nthreads=1, calculation='scf', gamma_only=None):
     '''
     Extracts the data for spillage optimization with spherical-wave
     reference states from an OUT.{suffix} directory.
 
     This function looks for certain data from the following files:
 
-        running_scf.log: natom, nzeta, wk, nspin
+        running_{calculation}.log: natom, nzeta, wk, nspin
         data-*-S: overlap matrices
         data-*-T: kinetic energy matrices
-        WFC_NAO-*.txt: LCAO wavefunction coefficients
+        WFC_NAO_{GAMMA,K}*.txt: LCAO wavefunction coefficients
+
+    The per-k files are independent of each other and are read by a pool
+    of `nthreads` threads (the text parsing in numpy releases the GIL).
+    WFC_NAO_GAMMA*.txt are read if gamma_only is True, WFC_NAO_K*.txt if
+    False. If gamma_only is None, it is assumed for a single k-point.
 
     The extracted data is packed to a dict with the following key-value pairs:
 
@@ -45,6 +81,8 @@ def _jy_data_extract(outdir):
         nzeta : list of list of int
             Number of zeta for each l of each atom type.
             nzeta[itype][l] -> int.
+        nspin : int
+            Number of spin channels.
         wk : ndarray, shape (nk,)
             k-point weights. For nspin = 2, the weights are replicated
             for spin-down (so the first and second halves are the same).
@@ -56,28 +94,47 @@ def _jy_data_extract(outdir):
             LCAO wavefunction coefficients.
 
     '''
-    info = read_running_scf_log(outdir + '/running_scf.log')
+    from multiprocessing.pool import ThreadPool
+
+    info, _, files = _jy_data_files(outdir, calculation, gamma_only)
     nspin, wk, natom, nzeta = [info[key] for key in
                                ['nspin', 'wk', 'natom', 'nzeta']]
 
     nk = len(wk)
-    S = [read_triu(f'{outdir}/data-{ik}-S') for ik in range(nk)]
-    T = [read_triu(f'{outdir}/data-{ik}-T') for ik in range(nk)]
 
-    wfc_suffix = 'GAMMA' if nk == 1 else 'K'
-    C = [read_wfc_lcao_txt(f'{outdir}/WFC_NAO_{wfc_suffix}{ik+1}.txt')[0]
-         for ik in range(nspin * nk)]
+    # (key, destination indices, reader, file)
+    # S & T are shared by both spins, so they are replicated for spin-down
+    tasks = [(key, [ik + ispin*nk for ispin in range(nspin)],
+              read_triu, files[key][ik])
+             for key in ['S', 'T'] for ik in range(nk)]
+    tasks += [('C', [isk],
+               lambda fname: read_wfc_lcao_txt(fname)[0],
+               files['C'][isk])
+              for isk in range(nspin * nk)]
+
+    def _load(task):
+        key, dest, reader, fname = task
+        return key, dest, reader(fname)
+
+    # results are written to preallocated arrays as soon as they arrive
+    dat = {}
+    with ThreadPool(nthreads) as pool:
+        for key, dest, M in pool.imap_unordered(_load, tasks):
+            if key not in dat:
+                dat[key] = np.empty((nspin * nk, *M.shape), dtype=M.dtype)
+            elif np.iscomplexobj(M) and not np.iscomplexobj(dat[key]):
+                dat[key] = dat[key].astype(complex)
+            dat[key][dest] = M
 
     if nspin == 2: # replicate for spin-down
-        S = [*S, *S]
-        T = [*T, *T]
         wk = [*wk, *wk]
 
-    return {'natom': natom, 'nzeta': nzeta, 'wk': wk,
-            'S': np.array(S), 'T': np.array(T), 'C': np.array(C)}
+    return {'natom': natom, 'nzeta': nzeta, 'nspin': nspin, 'wk': wk,
+            'S': dat['S'], 'T': dat['T'], 'C': dat['C']}
 
 
-def _initgen_core(nzeta, nbes_data, ref_jy, wk, nbes_gen, diagnosis):
+def _initgen_core(nzeta, nbes_data, ref_jy, wk, nbes_gen, diagnosis,
+                  eig=None):
     '''
     Computational core of initgen_jy and initgen_pw.
 
@@ -107,6 +164,10 @@ def _initgen_core(nzeta, nbes_data, ref_jy, wk, nbes_gen, diagnosis):
             shape (nbands*(2*l+1), nbes_data[l]).
             (The data is assume for a single atom, so the number of spherical
             waves per l is simply (2l+1) * nbes_data[l].)
+        eig : dict or None
+            If given, the eigen-decomposition of the above matrix is looked
+            up in (or stored to) eig[(l, nbes_gen[l])], which allows it to
+            be reused by calls with the same data but different nzeta.
 
     Returns
     -------
@@ -127,14 +188,19 @@ def _initgen_core(nzeta, nbes_data, ref_jy, wk, nbes_gen, diagnosis):
             coef.append([])
             continue
 
-        Y = ref_jy[:,:,range(delim[l], delim[l+1])] \
-            .reshape(nk, nbands*(2*l+1), nbes_data[l]) \
-            [:,:,:nbes_gen[l]]
+        if eig is not None and (l, nbes_gen[l]) in eig:
+            val, vec = eig[(l, nbes_gen[l])]
+        else:
+            Y = ref_jy[:,:,range(delim[l], delim[l+1])] \
+                .reshape(nk, nbands*(2*l+1), nbes_data[l]) \
+                [:,:,:nbes_gen[l]]
 
-        YdaggerY = ((Y.swapaxes(-2, -1).conj() @ Y)
-                    * wk.reshape(-1, 1, 1)).sum(0).real
+            YdaggerY = ((Y.swapaxes(-2, -1).conj() @ Y)
+                        * wk.reshape(-1, 1, 1)).sum(0).real
 
-        val, vec = np.linalg.eigh(YdaggerY)
+            val, vec = np.linalg.eigh(YdaggerY)
+            if eig is not None:
+                eig[(l, nbes_gen[l])] = (val, vec)
 
         # eigenvectors corresponding to the largest nzeta eigenvalues
         coef.append(vec[:,-nzeta_l:][:,::-1].T.tolist())
@@ -189,46 +255,8 @@ def initgen_jy(outdir, nzeta, ibands='all', nbes_gen=None, diagnosis=False):
     this should yield normalized orbitals in practice.
 
     '''
-    dat = _jy_data_extract(outdir)
-    natom, nbes_data, wk, S, T, C = \
-            [dat[key] for key in ['natom', 'nzeta', 'wk', 'S', 'T', 'C']]
-
-    ref_jy = C.swapaxes(-2, -1).conj() @ S
-    p = perm_zeta_m(_lin2comp(natom, nzeta=nbes_data))
-    ref_jy = ref_jy[:,:,p]
-
-    # remove the 'itype' layer
-    nbes_data = nbes_data[0]
-
-    if nbes_gen is None:
-        nbes_gen = nbes_data
-    elif isinstance(nbes_gen, int):
-        nbes_gen = [nbes_gen] * len(nzeta)
-    else: # must be a list of int
-        assert all(isinstance(n, int) for n in nbes_gen)
-
-    if ibands == 'all':
-        ibands = range(ref_jy.shape[1])
-
-    # some sanity checks
-    # 1. the data is indeed from a single atom
-    assert natom == [1]
-    assert(sum((2*l+1) * nbes_l for l, nbes_l in enumerate(nbes_data))
-           == ref_jy.shape[-1])
-
-    # 2. nzeta must not exceed nbes_gen
-    assert len(nzeta) <= len(nbes_gen)
-    assert all(nzeta[l] <= nbes_gen[l] for l in range(len(nzeta)))
-
-    # 3. nbes_gen must not exceed nbes_data
-    assert len(nbes_gen) <= len(nbes_data)
-    assert all(nbes_gen[l] <= nbes_data[l] for l in range(len(nbes_gen)))
-
-    # 4. band indices must be within the range
-    assert all(0 <= ib < ref_jy.shape[1] for ib in ibands)
-
-    return _initgen_core(nzeta, nbes_data, ref_jy[:,ibands,:],
-                         wk, nbes_gen, diagnosis)
+    return MonomerRef.load_jy(outdir).initgen(nzeta, ibands, nbes_gen,
+                                              diagnosis)
 
 
 def initgen_pw(orb_mat, nzeta, ibands='all', nbes_gen=None, diagnosis=False):
@@ -269,57 +297,204 @@ def initgen_pw(orb_mat, nzeta, ibands='all', nbes_gen=None, diagnosis=False):
     radial functions and are normalized.
 
     '''
-    ov = read_orb_mat(orb_mat)
+    return MonomerRef.load_pw(orb_mat).initgen(nzeta, ibands, nbes_gen,
+                                               diagnosis)
 
-    ntype, natom, lmax, nbes, rcut, wk = \
-        [ov[key] for key in ['ntype', 'natom', 'lmax', 'nbes', 'rcut', 'wk']]
 
-    # The output of PW calculation is based on raw truncated spherical
-    # waves, while the optimization will be performed w.r.t. the reduced
-    # basis, so a basis transformation of ref_jy & jy_jy is needed.
-    coef = [[jl_reduce(l, nbes, rcut).T.tolist()
-             for l in range(lmax[itype]+1)]
-            for itype in range(ntype)]
+class MonomerRef:
+    '''
+    Single-atom (monomer) reference data for initial-guess generation.
 
-    # number of raw spherical wave radial functions per l
-    # nbes[itype][l] -> int
-    nbes_raw = [[nbes] * (lmax[itype] + 1) for itype in range(ntype)]
+    An onion optimization generates the initial guess of every level from
+    the same monomer calculation. Instances obtained by load_jy/load_pw
+    are memoized within the process, so the monomer data are read (and
+    transformed to <ref|jy>) only once, while the eigen-decompositions of
+    _initgen_core and the band-wise angular momentum analysis are cached
+    in the instance for all levels.
 
-    ref_jy = ov['ref_jy'] @ jy2ao(coef, natom, nbes_raw)
+    Attributes
+    ----------
+        nbes_data : list of int
+            Number of spherical Bessel components for each l.
+        ref_jy : ndarray, shape (nk, nbands, njy)
+            Overlap between the reference states and spherical waves (jy)
+            in the lexicographic order of (l, m, q). Read-only.
+        wk : ndarray, shape (nk,)
+            k-point weights.
+        jy_data : dict or None
+            Data extracted by _jy_data_extract (None for PW references).
 
+    '''
+    def __init__(self, nbes_data, ref_jy, wk, jy_data=None):
+        self.nbes_data = nbes_data
+        self.ref_jy = ref_jy
+        self.ref_jy.setflags(write=False)
+        self.wk = np.asarray(wk)
+        self.jy_data = jy_data
 
-    # number of reduced spherical wave radial functions per l
-    nbes_data = [nbes - 1] * (lmax[0] + 1)
+        # eigen-decompositions of _initgen_core for each (ibands, nbes_gen)
+        self._eig = {}
 
-    if nbes_gen is None:
-        nbes_gen = nbes_data
-    elif isinstance(nbes_gen, int):
-        nbes_gen = [nbes_gen] * len(nzeta)
-    else: # must be a list of int
-        assert all(isinstance(n, int) for n in nbes_gen)
+        # results of band_analysis for each (count_thr, itype)
+        self._wl = {}
 
-    if ibands == 'all':
-        ibands = range(ref_jy.shape[1])
 
-    # some sanity checks
-    # 1. the data is indeed from a single atom
-    assert natom == [1]
-    assert(sum((2*l+1) * nbes_l for l, nbes_l in enumerate(nbes_data))
-           == ref_jy.shape[-1])
+    @staticmethod
+    def load_jy(outdir, calculation='scf', gamma_only=None):
+        '''
+        Monomer data from an OUT.{suffix} directory of a calculation with
+        spherical waves as the basis. See initgen_jy for details, and
+        _jy_data_extract for calculation & gamma_only.
 
-    # 2. nzeta must not exceed nbes_gen
-    assert len(nzeta) <= len(nbes_gen)
-    assert all(nzeta[l] <= nbes_gen[l] for l in range(len(nzeta)))
+        '''
+        outdir = os.path.abspath(outdir)
+        _, gamma_only, files = _jy_data_files(outdir, calculation, gamma_only)
+        fnames = [files['log'], *files['S'], *files['T'], *files['C']]
+        stamp = tuple((f, os.stat(f).st_mtime_ns) for f in fnames)
+        return _monomer_ref_load('jy', outdir, stamp, calculation, gamma_only)
 
-    # 3. nbes_gen must not exceed nbes_data
-    assert len(nbes_gen) <= len(nbes_data)
-    assert all(nbes_gen[l] <= nbes_data[l] for l in range(len(nbes_gen)))
 
-    # 4. band indices must be within the range
-    assert all(0 <= ib < ref_jy.shape[1] for ib in ibands)
+    @staticmethod
+    def load_pw(orb_mat):
+        '''
+        Monomer data from an orb_matrix file of a plane-wave calculation.
+        See initgen_pw for details.
+
+        '''
+        orb_mat = os.path.abspath(orb_mat)
+        stamp = ((orb_mat, os.stat(orb_mat).st_mtime_ns),)
+        return _monomer_ref_load('pw', orb_mat, stamp)
 
-    return _initgen_core(nzeta, nbes_data, ref_jy[:,ibands,:],
-                         wk, nbes_gen, diagnosis)
+
+    def initgen(self, nzeta, ibands='all', nbes_gen=None, diagnosis=False):
+        '''
+        Initial guess of the spherical Bessel coefficients. See initgen_jy
+        for the parameters.
+
+        '''
+        ref_jy, nbes_data = self.ref_jy, self.nbes_data
+
+        if nbes_gen is None:
+            nbes_gen = nbes_data
+        elif isinstance(nbes_gen, int):
+            nbes_gen = [nbes_gen] * len(nzeta)
+        else: # must be a list of int
+            assert all(isinstance(n, int) for n in nbes_gen)
+
+        if ibands == 'all':
+            ibands = range(ref_jy.shape[1])
+
+        # some sanity checks
+        # 1. nzeta must not exceed nbes_gen
+        assert len(nzeta) <= len(nbes_gen)
+        assert all(nzeta[l] <= nbes_gen[l] for l in range(len(nzeta)))
+
+        # 2. nbes_gen must not exceed nbes_data
+        assert len(nbes_gen) <= len(nbes_data)
+        assert all(nbes_gen[l] <= nbes_data[l] for l in range(len(nbes_gen)))
+
+        # 3. band indices must be within the range
+        assert all(0 <= ib < ref_jy.shape[1] for ib in ibands)
+
+        eig = self._eig.setdefault((tuple(ibands), tuple(nbes_gen)), {})
+        return _initgen_core(nzeta, nbes_data, ref_jy[:,list(ibands),:],
+                             self.wk, nbes_gen, diagnosis, eig)
+
+
+    def band_analysis(self, count_thr=1e-1, itype=0):
+        '''
+        Band indices of each angular momentum by the angular momentum
+        analysis (see lcao_wfc_analysis._wll) of the LCAO wave functions
+        of a spherical-wave calculation.
+
+        Returns
+        -------
+            A nested list. out[ispin][l] -> list of band indices whose
+            weight of l is no less than count_thr.
+
+        '''
+        key = (count_thr, itype)
+        if key not in self._wl:
+            dat = self.jy_data
+            lmaxmax = len(dat['nzeta'][itype]) - 1
+            assert lmaxmax >= 0, \
+                    f"lmaxmax should be at least 0: {lmaxmax}"
+
+            # if nspin == 2, "spin-up" k-points are listed first
+            nsk = len(dat['C'])
+            nk = nsk // dat['nspin']
+            out = [[[] for _ in range(lmaxmax + 1)]
+                   for _ in range(dat['nspin'])]
+            for isk in range(nsk):
+                wll = _wll(dat['C'][isk], dat['S'][isk],
+                           dat['natom'], dat['nzeta'])
+                for ib, wb in enumerate(wll): # loop over bands
+                    wlb = np.sum(wb.real, 1)
+                    for l, wl in enumerate(wlb):
+                        if wl >= count_thr:
+                            out[isk % nk][l].append(ib)
+
+            self._wl[key] = out
+
+        return deepcopy(self._wl[key])
+
+
+@functools.lru_cache(maxsize=4)
+def _monomer_ref_load(basis, path, stamp, calculation='scf', gamma_only=None):
+    '''
+    Memoized construction of MonomerRef. stamp holds the name and the
+    modification time of every file to read, which invalidates the entry
+    when any of them is updated.
+
+    '''
+    if basis == 'jy':
+        dat = _jy_data_extract(path, 1, calculation, gamma_only)
+        natom, nbes_data, S, C = \
+                [dat[key] for key in ['natom', 'nzeta', 'S', 'C']]
+
+        # the data must be from a single atom
+        assert natom == [1]
+
+        ref_jy = C.swapaxes(-2, -1).conj() @ S
+        p = perm_zeta_m(_lin2comp(natom, nzeta=nbes_data))
+        ref_jy = ref_jy[:,:,p]
+
+        # remove the 'itype' layer
+        nbes_data = nbes_data[0]
+
+        mono = MonomerRef(nbes_data, ref_jy, dat['wk'], dat)
+
+    else:
+        ov = read_orb_mat(path)
+
+        ntype, natom, lmax, nbes, rcut, wk = \
+            [ov[key] for key in ['ntype', 'natom', 'lmax', 'nbes', 'rcut', 'wk']]
+
+        # the data must be from a single atom
+        assert natom == [1]
+
+        # The output of PW calculation is based on raw truncated spherical
+        # waves, while the optimization will be performed w.r.t. the reduced
+        # basis, so a basis transformation of ref_jy & jy_jy is needed.
+        coef = [[jl_reduce(l, nbes, rcut).T.tolist()
+                 for l in range(lmax[itype]+1)]
+                for itype in range(ntype)]
+
+        # number of raw spherical wave radial functions per l
+        # nbes[itype][l] -> int
+        nbes_raw = [[nbes] * (lmax[itype] + 1) for itype in range(ntype)]
+
+        ref_jy = ov['ref_jy'] @ jy2ao(coef, natom, nbes_raw)
+
+        # number of reduced spherical wave radial functions per l
+        nbes_data = [nbes - 1] * (lmax[0] + 1)
+
+        mono = MonomerRef(nbes_data, ref_jy, wk)
+
+    assert(sum((2*l+1) * nbes_l for l, nbes_l in enumerate(nbes_data))
+           == mono.ref_jy.shape[-1])
+
+    return mono
 
 
 def _overlap_spillage(natom, nbes, jy_jy, ref_jy, ref_ref, wk,
@@ -382,12 +557,12 @@ def _overlap_spillage(natom, nbes, jy_jy, ref_jy, ref_ref, wk,
     spill = (wk @ ref_ref[:,ibands]).real.sum()
 
     ref_jy = ref_jy[:,ibands,:]
-    _jy2ao = jy2ao(coef, natom, nbes)
+    _jy2ao = BlockJy2ao(coef, natom, nbes)
     V = ref_jy @ _jy2ao
     W = _jy2ao.T @ jy_jy @ _jy2ao
 
     if coef_frozen is not None:
-        jy2frozen = jy2ao(coef_frozen, natom, nbes)
+        jy2frozen = BlockJy2ao(coef_frozen, natom, nbes)
         X = ref_jy @ jy2frozen
         S = jy2frozen.T @ jy_jy @ jy2frozen
         X_dual = mrdiv(X, S)
@@ -400,6 +575,185 @@ def _overlap_spillage(natom, nbes, jy_jy, ref_jy, ref_ref, wk,
     return spill / len(ibands)
 
 
+def _blas_nthreads(nworkers):
+    '''
+    Number of BLAS threads per worker such that nworkers * blas_nthreads
+    does not exceed the number of cores available to this process.
+
+    '''
+    try:
+        ncores = len(os.sched_getaffinity(0))
+    except AttributeError: # not available on some platforms
+        ncores = os.cpu_count() or 1
+    return max(1, ncores // nworkers)
+
+
+# environment variables that control the number of BLAS threads
+_BLAS_ENV = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+# handle of an ndarray placed in shared memory
+_ShmArray = namedtuple('_ShmArray', ['name', 'shape', 'dtype'])
+
+
+def _shm_put(arr, shms):
+    '''
+    Copies an ndarray to a new block of shared memory and returns its
+    (picklable) handle. The SharedMemory object is appended to shms.
+
+    '''
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shms.append(shm)
+    np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+    return _ShmArray(shm.name, arr.shape, arr.dtype.str)
+
+
+def _shm_get(handle, shms):
+    '''
+    Attaches to the shared memory specified by the handle and returns an
+    ndarray backed by it. The SharedMemory object is appended to shms
+    (the array is valid as long as the SharedMemory object is open).
+
+    '''
+    shm = shared_memory.SharedMemory(name=handle.name)
+    shms.append(shm)
+    return np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=shm.buf)
+
+
+def _double(x):
+    '''
+    Casts an array to double precision (float64 or complex128) if needed.
+
+    '''
+    return x.astype(np.promote_types(x.dtype, np.float64), copy=False)
+
+
+def _frozen_increment(coef_old, coef_new):
+    '''
+    Given two nested-list coefficients coef[itype][l][zeta][q], returns
+    the orbitals of coef_new that are not in coef_old if coef_new extends
+    coef_old by appending zeta functions (for each itype and l), or None
+    otherwise.
+
+    '''
+    if len(coef_old) != len(coef_new):
+        return None
+
+    coef_inc = []
+    for coef_old_t, coef_new_t in zip(coef_old, coef_new):
+        if len(coef_old_t) > len(coef_new_t):
+            return None
+        coef_inc.append([])
+        for l, coef_new_tl in enumerate(coef_new_t):
+            coef_old_tl = coef_old_t[l] if l < len(coef_old_t) else []
+            nz = len(coef_old_tl)
+            if coef_new_tl[:nz] != coef_old_tl:
+                return None
+            coef_inc[-1].append(coef_new_tl[nz:])
+
+    return coef_inc
+
+
+def _band_slice(ibands):
+    '''
+    Converts band indices to a basic slice if they are equally spaced in
+    ascending order, so that indexing gives a view instead of a copy.
+    Otherwise the indices are returned as is (fancy indexing).
+
+    '''
+    ibands = list(ibands)
+    if not ibands:
+        return slice(0, 0)
+
+    step = ibands[1] - ibands[0] if len(ibands) > 1 else 1
+    if step > 0 and ibands == list(range(ibands[0], ibands[-1] + 1, step)):
+        return slice(ibands[0], ibands[-1] + 1, step)
+
+    return ibands
+
+
+# per-process state of the workers of the process backend of Spillage.opt
+_worker = {}
+
+def _limit_blas(blas_nthreads):
+    '''
+    Limits the number of BLAS threads of a worker process spawned by
+    _spawn_pool (used as, or called by, the initializer of the pool).
+
+    '''
+    try:
+        # environment variables have been set before spawning, but
+        # threadpoolctl (if available) covers BLAS libraries that are
+        # not controlled by them
+        from threadpoolctl import threadpool_limits
+        _worker['blas_limits'] = threadpool_limits(blas_nthreads)
+    except ImportError:
+        pass
+
+
+def _spawn_pool(nprocs, blas_nthreads, initializer=None, initargs=()):
+    '''
+    Spawns a pool of nprocs worker processes, each of which runs BLAS
+    with blas_nthreads threads.
+
+    The BLAS environment variables are set while the workers are spawned
+    (so that they are inherited by the workers only) and restored in the
+    parent afterwards.
+
+    '''
+    import multiprocessing as mp
+
+    # "spawn" (instead of "fork") makes sure that BLAS in the workers
+    # is initialized with the environment variables below
+    env = {key: os.environ.get(key) for key in _BLAS_ENV}
+    os.environ.update({key: str(blas_nthreads) for key in _BLAS_ENV})
+    try:
+        return mp.get_context('spawn').Pool(nprocs, initializer, initargs)
+    finally:
+        for key, val in env.items():
+            if val is None:
+                os.environ.pop(key)
+            else:
+                os.environ[key] = val
+
+
+def _opt_worker_init(config, windows, blas_nthreads):
+    '''
+    Initializer of the worker processes of Spillage.opt.
+
+    ndarrays in config & windows (band windows prepared by opt) are passed
+    as handles of shared memory, which are attached (not copied) here.
+
+    '''
+    _limit_blas(blas_nthreads)
+
+    shms = []
+    get = lambda x: _shm_get(x, shms) if isinstance(x, _ShmArray) else x
+
+    orbgen = Spillage()
+    orbgen.config = [{key: get(val) for key, val in dat.items()}
+                     for dat in config]
+
+    _worker['orbgen'] = orbgen
+    _worker['windows'] = [{key: get(val) for key, val in window.items()}
+                          for window in windows]
+    _worker['shms'] = shms
+
+
+def _opt_worker_eval(args):
+    '''
+    Generalized spillage and its (flat) gradient of a single
+    configuration evaluated in a worker process.
+
+    '''
+    iconf, coef, iwin, full_precision = args
+    spill, grad = _worker['orbgen']._generalized_spillage(
+            iconf, coef, _worker['windows'][iwin], with_grad=True,
+            full_precision=full_precision)
+    return spill, grad.data
+
+
 class Spillage:
     '''
     Generalized spillage function and its optimization.
@@ -441,16 +795,22 @@ class Spillage:
             ref_Pfrozen_jy[iconf][0] and ref_Pfrozen_jy[iconf][1] correspond
             to <ref|P_frozen|jy> and <ref|P_frozen op|jy> respectively. Each
             of them has a shape of (nk, nbands, njy).
-        ref_Qfrozen_dao : list of ndarray
-            Derivatives of <ref|Q_frozen|ao> and <ref|Q_frozen op|ao> w.r.t.
-            the spherical wave radial coefficients (Q_frozen is the projection
-            operator onto the complement of the frozen subspace).
-        dao_jy : list of ndarray
-            The derivatives of <ao|jy> and <ao|op|jy> w.r.t. the coefficients
-            for each configuration.
+
+        precision : {'double', 'single'}
+            Storage precision of jy_jy, ref_jy and ref_Pfrozen_jy. In the
+            single-precision mode they are stored as float32/complex64,
+            which halves the memory footprint. Products with these arrays
+            are then evaluated in single precision, while the (much smaller)
+            AO-space matrices, solves and accumulations are in double
+            precision; opt() checks its result in double precision and, if
+            the (projected) gradient there exceeds gtol, finishes with a
+            short refinement in which everything is evaluated in double
+            precision.
 
     '''
-    def __init__(self):
+    def __init__(self, precision='double'):
+        assert precision in ('double', 'single')
+        self.precision = precision
         self.reset()
 
 
@@ -458,8 +818,21 @@ class Spillage:
         self.config = []
         self.spill_frozen = None
         self.ref_Pfrozen_jy = None
-        self.ref_Qfrozen_dao = None
-        self.dao_jy = None
+
+        # per-configuration orthonormal basis of the frozen subspace
+        # (see _tab_frozen), kept between calls for incremental updates
+        self._frozen = []
+
+
+    def _store(self, x):
+        '''
+        Casts an array to the storage precision (always returns a copy).
+
+        '''
+        single = self.precision == 'single'
+        if np.iscomplexobj(x):
+            return x.astype(np.complex64 if single else np.complex128)
+        return x.astype(np.float32 if single else np.float64)
 
 
     def _tab_frozen(self, coef_frozen):
@@ -474,137 +847,290 @@ class Spillage:
 
                         P_frozen = |frozen_dual><frozen|
 
-        '''
-        self.spill_frozen = [None] * len(self.config)
-        self.ref_Pfrozen_jy = [None] * len(self.config)
+        The frozen subspace of each configuration is kept as an orthonormal
+        basis |o> = |jy> B (P_frozen = |o><o|). If coef_frozen extends the
+        frozen orbitals of the previous call by appending zeta functions
+        (as is the case between onion levels), only the new orbitals are
+        orthonormalized against |o> and added (block update); otherwise
+        the tabulation starts over. coef_frozen = None clears all
+        frozen-orbital data.
 
+        '''
         if coef_frozen is None:
+            self.spill_frozen = None
+            self.ref_Pfrozen_jy = None
+            self._frozen = [None] * len(self.config)
             return
 
-        for iconf, dat in enumerate(self.config):
-            jy2frozen = jy2ao(coef_frozen, dat['natom'], dat['nbes'])
-
-            frozen_frozen = jy2frozen.T @ dat['jy_jy'] @ jy2frozen
-            ref_frozen = dat['ref_jy'] @ jy2frozen
+        coef_frozen = FlatCoef(coef_frozen).tolist()
 
-            # no need to compute <ref|op|frozen_dual>
-            ref_frozen_dual = mrdiv(ref_frozen[0], frozen_frozen[0])
+        nconf = len(self.config)
+        self._frozen += [None] * (nconf - len(self._frozen))
+        if self.ref_Pfrozen_jy is None:
+            self.ref_Pfrozen_jy = [None] * nconf
+        self.ref_Pfrozen_jy += [None] * (nconf - len(self.ref_Pfrozen_jy))
+        self.spill_frozen = [None] * nconf
 
-            self.ref_Pfrozen_jy[iconf] = \
-                    ref_frozen_dual @ jy2frozen.T @ dat['jy_jy']
+        for iconf, dat in enumerate(self.config):
+            frozen = self._frozen[iconf]
+            coef_new = None if frozen is None \
+                    else _frozen_increment(frozen['coef'], coef_frozen)
+
+            if coef_new is None: # start over
+                nk, nbands, njy = dat['ref_jy'].shape[1:]
+                nk_jy = dat['jy_jy'].shape[1]
+                frozen = {'coef': [[[] for _ in coef_t]
+                                   for coef_t in coef_frozen],
+                          'B': np.zeros((nk_jy, njy, 0)),
+                          'jy_o': np.zeros((2, nk_jy, njy, 0)),
+                          'ref_o': np.zeros((2, nk, nbands, 0)),
+                          'o_op_o': np.zeros((nk_jy, 0, 0))}
+                self._frozen[iconf] = frozen
+                self.ref_Pfrozen_jy[iconf] = self._store(
+                        np.zeros((2, nk, nbands, njy),
+                                 np.result_type(dat['ref_jy'],
+                                                dat['jy_jy'])))
+                coef_new = coef_frozen
+
+            self._frozen_add(iconf, coef_new)
+            frozen['coef'] = coef_frozen
 
             # spill_frozen before weighted sum over k
-            tmp = rfrob(ref_frozen_dual @ frozen_frozen[1],
-                        ref_frozen_dual, True) \
-                    - 2.0 * rfrob(ref_frozen_dual, ref_frozen[1], True)
+            ref_o = frozen['ref_o']
+            tmp = rfrob(ref_o[0] @ frozen['o_op_o'], ref_o[0], True) \
+                    - 2.0 * rfrob(ref_o[0], ref_o[1], True)
 
             self.spill_frozen[iconf] = dat['wk'] @ tmp
 
 
-    def _tab_deriv(self, coef):
+    def _frozen_add(self, iconf, coef_new):
         '''
-        Given coef which specifies a set of pseudo-atomic orbitals from
-        spherical waves, this function tabulates for each configuration
-        the derivatives of
+        Adds the orbitals specified by coef_new to the frozen subspace of
+        a configuration and updates ref_Pfrozen_jy accordingly.
 
-                                <ao|jy>
-                                <ao|op|jy>
+        With |F> = |jy> J being the new orbitals, their components
+        orthogonal to the existing orthonormal basis |o>,
 
-                            <ref|Q_frozen   |ao>
-                            <ref|Q_frozen op|ao>
+                        |N> = |F> - |o><o|F>
 
-        with respect to each element of coef, where Q_frozen is the
-        projection operator onto the complement of the frozen subspace:
+        are orthonormalized by the inverse square root of <N|N>, which gives
+        the new basis vectors |o_new> and
 
-                        Q_frozen = 1 - |frozen_dual><frozen|
+            P_frozen <- P_frozen + |o_new><o_new|
 
-        (Q_frozen = 1 if there is no frozen orbitals)
+        Directions of |N> whose squared norm is below 1e-8 of the largest
+        <F|F> are considered linearly dependent on the existing frozen
+        orbitals (or each other) and dropped, so that their numerical
+        noise is not amplified by the inverse square root.
 
+        '''
+        dat = self.config[iconf]
+        frozen = self._frozen[iconf]
+        dagger = lambda A: A.swapaxes(-1, -2).conj()
+
+        J = BlockJy2ao(coef_new, dat['natom'], dat['nbes'])
+        if J.shape[1] == 0:
+            return
 
-        Note
-        ----
-        The only useful information of coef is its nesting pattern; its
-        values are not used in this function.
+        B, jy_o, ref_o = frozen['B'], frozen['jy_o'], frozen['ref_o']
 
+        # <jy|F>, <jy|op|F> and <o|F>
+        jy_F = _double(dat['jy_jy'] @ J)
+        o_F = dagger(B) @ jy_F[0]
+
+        # <jy|N>, <jy|op|N>, <ref|N> and <ref|op|N>
+        jy_N = jy_F - jy_o @ o_F
+        ref_N = _double(dat['ref_jy'] @ J) - ref_o @ o_F
+
+        # <N|N> = <F|N>
+        N_N = J.T @ jy_N[0]
+        F_F = np.diagonal(J.T @ jy_F[0], axis1=-2, axis2=-1).real
+        e, U = np.linalg.eigh(0.5 * (N_N + dagger(N_N)))
+        keep = e > np.max(F_F, -1, keepdims=True) * 1e-8
+        X = U * np.where(keep, 1.0 / np.sqrt(np.where(keep, e, 1.0)), 0.0) \
+                [...,None,:]
+
+        B_new = (J.toarray() - B @ o_F) @ X
+        jy_new = jy_N @ X
+        ref_new = ref_N @ X
+
+        # <o|op|o> in terms of the enlarged basis
+        o_op_new = dagger(B) @ jy_new[1]
+        frozen['o_op_o'] = np.concatenate([
+            np.concatenate([frozen['o_op_o'], o_op_new], axis=-1),
+            np.concatenate([dagger(o_op_new), dagger(B_new) @ jy_new[1]],
+                           axis=-1)
+            ], axis=-2)
+
+        frozen['B'] = np.concatenate([B, B_new], axis=-1)
+        frozen['jy_o'] = np.concatenate([jy_o, jy_new], axis=-1)
+        frozen['ref_o'] = np.concatenate([ref_o, ref_new], axis=-1)
+
+        self.ref_Pfrozen_jy[iconf] += ref_new[0] @ dagger(jy_new)
+
+
+    def _band_window(self, iconf, ibands, compress=False):
         '''
-        self.dao_jy = [None] * len(self.config)
-        self.ref_Qfrozen_dao = [None] * len(self.config)
+        Band-dependent data of a configuration that enter the generalized
+        spillage, i.e., the stacked <ref|Q_frozen|jy> and <ref|Q_frozen op|jy>
+        of the selected bands and the part of the spillage that does not
+        depend on the coefficients.
 
-        for iconf, dat in enumerate(self.config):
-            jy2dao = [jy2ao(nest(ci.tolist(), nestpat(coef)),
-                            dat['natom'], dat['nbes'])
-                      for ci in np.eye(len(flatten(coef)))]
+        If compress is True, the band dimension of <ref|Q_frozen|jy> is
+        contracted by a truncated SVD
 
-            self.dao_jy[iconf] = \
-                    np.array([jy2dao_i.T @ dat['jy_jy']
-                              for jy2dao_i in jy2dao]) \
-                    .transpose(1,0,2,3,4)
+                <ref|Q_frozen|jy> = U S Vh
 
-            self.ref_Qfrozen_dao[iconf] = \
-                    np.array([dat['ref_jy'] @ jy2dao_i
-                              for jy2dao_i in jy2dao])
+        where only the numerically nonzero singular values are kept, and
+        the stacked matrix is replaced by (S Vh, U^H <ref|Q_frozen op|jy>).
+        Since the spillage depends on <ref|Q_frozen|jy> only via the Gram-type
+        matrices <jy|Q_frozen|ref><ref|Q_frozen|jy> and <jy|Q_frozen op|ref>
+        <ref|Q_frozen|jy>, which are invariant under this replacement, the
+        spillage and its gradient are unchanged, while the number of rows is
+        reduced to the rank (<= njy) if it is smaller than nbands.
 
-            if self.spill_frozen is not None:
-                self.ref_Qfrozen_dao[iconf] -= \
-                        np.array([self.ref_Pfrozen_jy[iconf] @ jy2dao_i
-                                  for jy2dao_i in jy2dao])
+        Returns a dict with keys 'ref_Qfrozen_jy', 'spill0' and 'nbands'.
 
-            self.ref_Qfrozen_dao[iconf] = \
-                    self.ref_Qfrozen_dao[iconf].transpose(1,0,2,3,4)
+        '''
+        dat = self.config[iconf]
+
+        if ibands == 'all':
+            ibands = range(dat['ref_ref'][1].shape[1])
+        nbands = len(ibands)
 
+        # basic slicing (if possible) avoids copying the unsliced data;
+        # without frozen orbitals and compression the window is a view
+        ibands = _band_slice(ibands)
 
-    def _generalized_spillage(self, iconf, coef, ibands, with_grad=False):
+        spill0 = (dat['wk'] @ dat['ref_ref'][1][:,ibands]).real.sum()
+
+        # <ref|Q_frozen|jy> and <ref|Q_frozen op|jy>
+        ref_Qfrozen_jy = dat['ref_jy'][:,:,ibands,:]
+        if self.spill_frozen is not None:
+            ref_Qfrozen_jy = ref_Qfrozen_jy \
+                    - self.ref_Pfrozen_jy[iconf][:,:,ibands,:]
+            spill0 += self.spill_frozen[iconf][ibands].sum()
+
+        if compress:
+            R = _double(ref_Qfrozen_jy)
+            U, S, Vh = np.linalg.svd(R[0], full_matrices=False)
+            tol = S[:,:1] * max(R.shape[-2:]) * np.finfo(S.dtype).eps
+            rank = max(np.sum(S > tol, axis=1).max(), 1)
+            if rank < R.shape[-2]:
+                U, S, Vh = U[:,:,:rank], S[:,:rank], Vh[:,:rank]
+                ref_Qfrozen_jy = self._store(np.array(
+                    [S[:,:,None] * Vh, U.swapaxes(-1, -2).conj() @ R[1]]))
+
+        return {'ref_Qfrozen_jy': ref_Qfrozen_jy, 'spill0': spill0,
+                'nbands': nbands}
+
+
+    def _generalized_spillage(self, iconf, coef, ibands, with_grad=False,
+                              full_precision=False):
         '''
         Generalized spillage function and its gradient with respect to
         spherical Bessel coefficients of a single configuration.
 
+        ibands is either the band indices or a dict returned by
+        _band_window (which is prepared once per optimization by opt).
+
+        If full_precision is True, single-precision data (if any) are cast
+        to double precision before use, so that all products are evaluated
+        in double precision.
+
         '''
         dat = self.config[iconf]
+        cast = _double if full_precision else lambda x: x
 
-        if ibands == 'all':
-            ibands = range(dat['ref_ref'][1].shape[1])
+        window = ibands if isinstance(ibands, dict) \
+                else self._band_window(iconf, ibands)
+        nbands = window['nbands']
 
-        spill = (dat['wk'] @ dat['ref_ref'][1][:,ibands]).real.sum()
-        _jy2ao = jy2ao(coef, dat['natom'], dat['nbes'])
+        spill = window['spill0']
+        _jy2ao = BlockJy2ao(coef, dat['natom'], dat['nbes'])
+        ref_Qfrozen_jy = cast(window['ref_Qfrozen_jy'])
 
         # <ref|Q_frozen|ao> and <ref|Q_frozen op|ao>
-        V = dat['ref_jy'][:,:,ibands,:] @ _jy2ao
-        if self.spill_frozen is not None:
-            V -= self.ref_Pfrozen_jy[iconf][:,:,ibands,:] @ _jy2ao
-            spill += self.spill_frozen[iconf][ibands].sum()
+        # (assembled in the storage precision; solves are in double)
+        V = _double(ref_Qfrozen_jy @ _jy2ao)
+
+        # <jy|ao> and <jy|op|ao>
+        jy_ao = cast(dat['jy_jy']) @ _jy2ao
 
         # <ao|ao> and <ao|op|ao>
-        W = _jy2ao.T @ dat['jy_jy'] @ _jy2ao
+        W = _double(_jy2ao.T @ jy_ao)
+
+        # W[0] is factorized once and reused by the gradient
+        W0_factor = chol_factor(W[0])
 
-        V_dual = mrdiv(V[0], W[0]) # overlap only; no need for op
+        V_dual = chol_mrdiv(V[0], W0_factor) # overlap only; no need for op
         VdaggerV = V_dual.transpose((0,2,1)).conj() @ V_dual
 
         spill += dat['wk'] @ (rfrob(W[1], VdaggerV)
                               - 2.0 * rfrob(V_dual, V[1]))
-        spill /= len(ibands)
+        spill /= nbands
 
         if with_grad:
-            # (d/dcoef)<ao|ao> and (d/dcoef)<ao|op|ao>
-            dW = self.dao_jy[iconf] @ _jy2ao
-            dW += dW.transpose((0,1,2,4,3)).conj()
+            # The spillage depends on coef only via _jy2ao. Its gradient
+            # w.r.t. the elements of _jy2ao reads
+            #
+            #   G = Re sum_k w[k] (<jy|op|ao> VdaggerV - <jy|ao> (Z^H V_dual
+            #       + h.c.) + <jy|Q_frozen|ref> Z - <jy|Q_frozen op|ref> V_dual)
+            #
+            # (times 2/nbands), which is contracted to coef once per (itype,
+            # l) over atoms and m by _jy2ao.coef_grad. Only the diagonal
+            # blocks of G are evaluated.
+            dagger = lambda A: A.swapaxes(-1, -2).conj()
+
+            Z = chol_mrdiv(V_dual @ W[1] - V[1], W0_factor)
+            ZdaggerV = dagger(Z) @ V_dual
+
+            w = 2.0 * np.asarray(dat['wk'])[:,None,None] / nbands
+            grad = _jy2ao.coef_grad([
+                (jy_ao, np.array([-ZdaggerV - dagger(ZdaggerV), VdaggerV]) * w),
+                (dagger(ref_Qfrozen_jy), np.array([Z, -V_dual]) * w),
+            ])
+
+        return (spill, grad) if with_grad else spill
 
-            # (d/dcoef)<ref|Q_frozen|ao> and (d/dcoef)<ref|Q_frozen op|ao>
-            dV = self.ref_Qfrozen_dao[iconf][:,:,:,ibands,:]
 
-            grad = (rfrob(dW[1], VdaggerV)
-                    - 2.0 * rfrob(V_dual, dV[1])
-                    + 2.0 * rfrob(dV[0] - V_dual @ dW[0],
-                                   mrdiv(V_dual @ W[1] - V[1], W[0]))
-                    ) @ dat['wk']
+    def _process_pool(self, nprocs, windows):
+        '''
+        Spawns a pool of worker processes for Spillage.opt.
 
-            grad /= len(ibands)
-            grad = nest(grad.tolist(), nestpat(coef))
+        Large arrays of all configurations (as well as the band windows
+        prepared by opt) are placed in shared memory, so that the workers attach to
+        them instead of receiving copies. The number of BLAS threads of
+        each worker is limited such that nprocs * (BLAS threads) matches
+        the number of available cores.
 
-        return (spill, grad) if with_grad else spill
+        Returns the pool and the list of SharedMemory objects, which must
+        be closed and unlinked by the caller after the pool is terminated.
+
+        '''
+        shms = []
+        put = lambda x: _shm_put(x, shms) if isinstance(x, np.ndarray) else x
+
+        config = [{key: put(val) for key, val in dat.items()}
+                  for dat in self.config]
+        windows = [{key: put(val) for key, val in window.items()}
+                   for window in windows]
+
+        blas_nthreads = _blas_nthreads(nprocs)
+        try:
+            pool = _spawn_pool(nprocs, blas_nthreads, _opt_worker_init,
+                               (config, windows, blas_nthreads))
+        except:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+            raise
+
+        return pool, shms
 
 
     def opt(self, coef_init, coef_frozen, iconfs, ibands,
-            options, nthreads=1):
+            options, nthreads=1, backend='thread', compress=True):
         '''
         Spillage minimization w.r.t. spherical Bessel coefficients.
 
@@ -630,16 +1156,32 @@ class Spillage:
             options : dict
                 Options for the optimization.
             nthreads : int
-                Number of threads for config-level parallelization.
+                Number of threads (or processes) for config-level
+                parallelization.
+            backend : {'thread', 'process'}
+                If 'thread', configurations are evaluated by a pool of
+                threads, which relies on numpy releasing the GIL.
+                If 'process', configurations are evaluated by a pool of
+                worker processes that hold the data in shared memory;
+                only the coefficients and (spill, grad) are exchanged in
+                each iteration. Each worker runs BLAS with
+                max(1, ncores // nthreads) threads (ncores being the
+                number of cores available to this process), set by the
+                BLAS environment variables (OMP_NUM_THREADS etc.) of the
+                workers and by threadpoolctl if available, so that the
+                workers together do not oversubscribe the cores. BLAS of
+                the calling process is not affected.
+            compress : bool
+                If True, the band dimension of the reference data is
+                contracted once before the optimization whenever the
+                number of bands exceeds the rank of <ref|Q_frozen|jy>
+                (see _band_window), so that the cost per iteration does
+                not grow with the number of bands beyond njy.
 
         '''
-        from multiprocessing.pool import ThreadPool
-        pool = ThreadPool(nthreads)
+        assert backend in ('thread', 'process')
 
-        if coef_frozen is not None:
-            self._tab_frozen(coef_frozen)
-
-        self._tab_deriv(coef_init)
+        self._tab_frozen(coef_frozen)
 
         if iconfs == 'all':
             iconfs = range(len(self.config))
@@ -650,35 +1192,75 @@ class Spillage:
 
         assert len(ibands) == nconfs
 
-        pat = nestpat(coef_init)
-        def f(c): # function to be minimized
-            s = lambda i: self._generalized_spillage(iconfs[i],
-                                                     nest(c.tolist(), pat),
-                                                     ibands[i],
-                                                     with_grad=True)
-            spills, grads = zip(*pool.map(s, range(nconfs)))
-            return (sum(spills) / nconfs,
-                    sum(np.array(flatten(g)) for g in grads) / nconfs)
-
-        c0 = np.array(flatten(coef_init))
-
-        bounds = [(-1.0, 1.0) for _ in c0]
-        res = minimize(f, c0, jac=True, method='L-BFGS-B',
-                       bounds=bounds, options=options)
+        # band-dependent data are prepared once for the whole optimization
+        windows = [self._band_window(iconfs[i], ibands[i], compress)
+                   for i in range(nconfs)]
+
+        # coefficients are passed around as flat arrays (with the offset
+        # index of FlatCoef) without going through nested lists
+        coef0 = FlatCoef(coef_init)
+
+        if backend == 'thread':
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(nthreads)
+            shms = []
+            def s(args):
+                iconf, coef, iwin, full_precision = args
+                spill, grad = self._generalized_spillage(
+                        iconf, coef, windows[iwin], with_grad=True,
+                        full_precision=full_precision)
+                return spill, grad.data
+        else:
+            pool, shms = self._process_pool(nthreads, windows)
+            s = _opt_worker_eval
 
-        # to use basinhopping:
-        #from scipy.optimize import basinhopping
-        #minimizer_kwargs = {"method": "L-BFGS-B", "jac": True,
-        #                    "bounds": bounds}
-        #res = basinhopping(f, c0, minimizer_kwargs=minimizer_kwargs,
-        #                   niter=20, disp=True)
+        def f(c, full_precision=False): # function to be minimized
+            coef = coef0.like(c)
+            tasks = [(iconfs[i], coef, i, full_precision)
+                     for i in range(nconfs)]
+            spills, grads = zip(*pool.map(s, tasks))
+            return sum(spills) / nconfs, sum(grads) / nconfs
 
-        pool.close()
+        c0 = coef0.data
 
-        coef_opt = nest(res.x.tolist(), pat)
-        return [[np.linalg.qr(np.array(coef_tl).T)[0].T.tolist()
-                 if coef_tl else []
-                 for coef_tl in coef_t] for coef_t in coef_opt]
+        bounds = [(-1.0, 1.0) for _ in c0]
+        try:
+            res = minimize(f, c0, jac=True, method='L-BFGS-B',
+                           bounds=bounds, options=options)
+
+            if self.precision == 'single':
+                # refinement with all products in double precision, which
+                # starts close to the minimum and is only needed if the
+                # projected gradient (as in L-BFGS-B) exceeds gtol there
+                _, g = f(res.x, True)
+                pg = np.clip(res.x - g, -1.0, 1.0) - res.x
+                if np.max(np.abs(pg)) > options.get('gtol', 1e-5):
+                    maxiter = min(options.get('maxiter', 15000), 50)
+                    res = minimize(f, res.x, args=(True,), jac=True,
+                                   method='L-BFGS-B', bounds=bounds,
+                                   options={**options, 'maxiter': maxiter})
+
+            # to use basinhopping:
+            #from scipy.optimize import basinhopping
+            #minimizer_kwargs = {"method": "L-BFGS-B", "jac": True,
+            #                    "bounds": bounds}
+            #res = basinhopping(f, c0, minimizer_kwargs=minimizer_kwargs,
+            #                   niter=20, disp=True)
+        finally:
+            pool.close()
+            pool.join()
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+        coef_opt = coef0.like(res.x.copy())
+        for itype, ncoef_t in enumerate(coef_opt.ncoef):
+            for l, ncoef_tl in enumerate(ncoef_t):
+                if ncoef_tl:
+                    coef_opt.set_block(itype, l, np.linalg.qr(
+                        coef_opt.block(itype, l))[0])
+
+        return coef_opt.tolist()
 
 
 class Spillage_jy(Spillage):
@@ -687,16 +1269,17 @@ class Spillage_jy(Spillage):
     with spherical-wave reference states.
 
     '''
-    def config_add(self, outdir, weight=(0.0, 1.0)):
+    def config_add(self, outdir, weight=(0.0, 1.0), nthreads=1):
         '''
         Adds a configuration by loading data from an OUT.{suffix} directory.
 
         The data will be processed and packed to a dict which is then
         appended to the config list. See the docstring of Spillage
-        for details of the dict.
+        for details of the dict. nthreads is the number of threads
+        used to read the per-k data files.
 
         '''
-        raw = _jy_data_extract(outdir)
+        raw = _jy_data_extract(outdir, nthreads)
         C, S, T = raw['C'], raw['S'], raw['T']
 
         wov, wop = weight
@@ -714,8 +1297,8 @@ class Spillage_jy(Spillage):
         # (itype, iatom, l, q, mm) where mm = 2*|m|-(m>0), which will be
         # transformed to a lexicographic order of (itype, iatom, l, mm, q)
         p = perm_zeta_m(_lin2comp(raw['natom'], nzeta=raw['nzeta']))
-        ref_jy = ref_jy[:,:,:,p].copy()
-        jy_jy = jy_jy[:,:,:,p][:,:,p,:].copy()
+        ref_jy = self._store(ref_jy[:,:,:,p])
+        jy_jy = self._store(jy_jy[:,:,:,p][:,:,p,:])
 
         self.config.append({
             'natom': raw['natom'],
@@ -734,8 +1317,8 @@ class Spillage_pw(Spillage):
 
     '''
 
-    def __init__(self, reduced=True):
-        super().__init__()
+    def __init__(self, reduced=True, precision='double'):
+        super().__init__(precision)
         self.rcut = None
 
 
@@ -801,8 +1384,8 @@ class Spillage_pw(Spillage):
             'nbes': nbes_rdc,
             'wk': ov['wk'],
             'ref_ref': ref_ref,
-            'ref_jy': ref_jy,
-            'jy_jy': jy_jy,
+            'ref_jy': self._store(ref_jy),
+            'jy_jy': self._store(jy_jy),
             })
 
 
@@ -812,6 +1395,7 @@ class Spillage_pw(Spillage):
 import unittest
 
 from SIAB.spillage.radial import build_reduced
+from SIAB.spillage.listmanip import merge
 from SIAB.spillage.plot import plot_chi
 
 import matplotlib.pyplot as plt
@@ -819,6 +1403,31 @@ import matplotlib.pyplot as plt
 
 class _TestSpillage(unittest.TestCase):
 
+    def test_jy_data_extract(self):
+        import os
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+
+        #outdir = './testfiles/Si/jy-7au/dimer-1.8-k/OUT.ABACUS/'
+        outdir = os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-k/OUT.ABACUS/')
+
+        dat = _jy_data_extract(outdir)
+        nk = len(dat['wk'])
+
+        self.assertEqual(dat['S'].shape[0], nk)
+        self.assertEqual(dat['T'].shape, dat['S'].shape)
+        self.assertEqual(dat['C'].shape[:2], dat['S'].shape[:2])
+        for ik in range(nk):
+            self.assertTrue(np.array_equal(
+                dat['S'][ik], read_triu(os.path.join(outdir, f'data-{ik}-S'))))
+
+        # multi-threaded loading yields the same data
+        dat_mt = _jy_data_extract(outdir, nthreads=3)
+        for key in ['S', 'T', 'C']:
+            self.assertEqual(dat_mt[key].dtype, dat[key].dtype)
+            self.assertTrue(np.array_equal(dat_mt[key], dat[key]))
+
+
     def test_initgen_jy_gamma(self):
         import os
         here = os.path.dirname(os.path.abspath(__file__))
@@ -871,6 +1480,66 @@ class _TestSpillage(unittest.TestCase):
         plt.show()
 
 
+    def test_monomer_ref(self):
+        import os
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+
+        outdir = os.path.join(testfiles, 'Si/jy-7au/monomer-gamma/OUT.ABACUS/')
+
+        # the monomer data is loaded only once within the process
+        mono = MonomerRef.load_jy(outdir)
+        self.assertIs(MonomerRef.load_jy(outdir + '/'), mono)
+        self.assertFalse(mono.ref_jy.flags.writeable)
+
+        # the cached eigen-decompositions are reused by subsequent levels
+        ibands = range(19)
+        coef = mono.initgen([3, 3, 2], ibands=ibands)
+        neig = len(mono._eig) # other tests may share the same instance
+        self.assertEqual(mono.initgen([3, 3, 2], ibands=ibands), coef)
+        self.assertEqual(initgen_jy(outdir, [3, 3, 2], ibands=ibands), coef)
+
+        # fewer zeta are the leading ones of more zeta
+        coef_less = mono.initgen([2, 1, 1], ibands=ibands)
+        for l, coef_l in enumerate(coef_less):
+            for coef_lz, coef_lz_ref in zip(coef_l, coef[l]):
+                self.assertTrue(np.allclose(np.abs(coef_lz),
+                                            np.abs(coef_lz_ref)))
+        self.assertEqual(len(mono._eig), neig)
+
+        # the results of the band analysis are not shared with the caller
+        out = mono.band_analysis()
+        self.assertEqual(len(out), mono.jy_data['nspin'])
+        out[0][0].append(-1)
+        self.assertNotEqual(mono.band_analysis(), out)
+
+        # an explicit gamma_only that resolves to the same files is shared
+        self.assertIs(MonomerRef.load_jy(outdir, 'scf', True), mono)
+        _, gamma_only, files = _jy_data_files(outdir, gamma_only=False)
+        self.assertFalse(gamma_only)
+        self.assertTrue(files['C'][0].endswith('WFC_NAO_K1.txt'))
+
+
+    def test_monomer_ref_stamp(self):
+        import os
+        import shutil
+        import tempfile
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+        src = os.path.join(testfiles, 'Si/jy-7au/monomer-gamma/OUT.ABACUS')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outdir = shutil.copytree(src, os.path.join(tmpdir, 'OUT.ABACUS'))
+            mono = MonomerRef.load_jy(outdir)
+            self.assertIs(MonomerRef.load_jy(outdir), mono)
+
+            # updating any of the files read invalidates the memo
+            fwfc = os.path.join(outdir, 'WFC_NAO_GAMMA1.txt')
+            mtime = os.stat(fwfc).st_mtime_ns + 10**9
+            os.utime(fwfc, ns=(mtime, mtime))
+            self.assertIsNot(MonomerRef.load_jy(outdir), mono)
+
+
     def test_initgen_pw_gamma(self):
         import os
         here = os.path.dirname(os.path.abspath(__file__))
@@ -975,71 +1644,148 @@ class _TestSpillage(unittest.TestCase):
                              (2, nk, nbands, njy))
 
 
-    def test_tab_deriv(self):
+    def test_tab_frozen_incremental(self):
         import os
         here = os.path.dirname(os.path.abspath(__file__))
         testfiles = os.path.join(here, 'testfiles')
 
-        # outdirs = [
-        #         './testfiles/Si/jy-7au/monomer-k/OUT.ABACUS/',
-        #         './testfiles/Si/jy-7au/dimer-1.8-gamma/OUT.ABACUS/',
-        #         ]
         outdirs = [
-                os.path.join(testfiles, 'Si/jy-7au/monomer-k/OUT.ABACUS/'),
                 os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-gamma/OUT.ABACUS/'),
+                os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-k/OUT.ABACUS/'),
                 ]
 
         orbgen = Spillage_jy()
-
+        orbgen_ref = Spillage_jy()
         for outdir in outdirs:
             orbgen.config_add(outdir)
+            orbgen_ref.config_add(outdir)
+
+        rng = np.random.default_rng(0)
+        nbes = [orbgen.config[0]['nbes'][0][l] for l in range(3)]
+        coef_lvl = [[[rng.standard_normal((nz, nbes[l])).tolist()
+                      for l, nz in enumerate(nzeta)]]
+                    for nzeta in [[1, 1], [1, 1, 1], [0, 1, 1]]]
+
+        # SZ -> DZP -> TZDP-like growth of the frozen subspace
+        coef_frozen = coef_lvl[0]
+        for lvl in range(len(coef_lvl)):
+            if lvl > 0:
+                coef_frozen = merge(coef_frozen, coef_lvl[lvl], 2)
+
+            orbgen._tab_frozen(coef_frozen)
+
+            orbgen_ref.reset()
+            for outdir in outdirs:
+                orbgen_ref.config_add(outdir)
+            orbgen_ref._tab_frozen(coef_frozen)
+
+            for iconf in range(len(outdirs)):
+                self.assertTrue(np.allclose(orbgen.spill_frozen[iconf],
+                                            orbgen_ref.spill_frozen[iconf]))
+                self.assertTrue(np.allclose(orbgen.ref_Pfrozen_jy[iconf],
+                                            orbgen_ref.ref_Pfrozen_jy[iconf]))
+
+        # a frozen set that does not extend the previous one
+        orbgen._tab_frozen(coef_lvl[2])
+        orbgen_ref.reset()
+        for outdir in outdirs:
+            orbgen_ref.config_add(outdir)
+        orbgen_ref._tab_frozen(coef_lvl[2])
+        for iconf in range(len(outdirs)):
+            self.assertTrue(np.allclose(orbgen.ref_Pfrozen_jy[iconf],
+                                        orbgen_ref.ref_Pfrozen_jy[iconf]))
 
-        coef = [[np.eye(3, 5).tolist(),
-                 np.eye(3, 5).tolist(),
-                 np.eye(2, 5).tolist()]]
+        # no frozen orbitals
+        orbgen._tab_frozen(None)
+        self.assertIsNone(orbgen.spill_frozen)
+        self.assertIsNone(orbgen.ref_Pfrozen_jy)
 
-        orbgen._tab_deriv(coef)
 
-        self.assertEqual(len(orbgen.dao_jy), len(outdirs))
-        self.assertEqual(len(orbgen.ref_Qfrozen_dao), len(outdirs))
+    def test_tab_frozen_near_dependent(self):
+        import os
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+        outdir = os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-k/OUT.ABACUS/')
 
-        for iconf, conf in enumerate(orbgen.config):
-            ncoef = len(flatten(coef))
-            njy = _nao(conf['natom'], conf['nbes'])
-            nk = len(conf['wk'])
-            nbands = conf['ref_ref'].shape[-1]
+        orbgen = Spillage_jy()
+        orbgen.config_add(outdir)
 
-            nzeta = [[len(coef_tl) for coef_tl in coef_t] for coef_t in coef]
-            nao = _nao(conf['natom'], nzeta)
+        rng = np.random.default_rng(0)
+        nbes = [orbgen.config[0]['nbes'][0][l] for l in range(2)]
+        coef_frozen = [[rng.standard_normal((1, nbes[0])).tolist(),
+                        rng.standard_normal((1, nbes[1])).tolist()]]
+        orbgen._tab_frozen(coef_frozen)
+        ref_Pfrozen_jy = orbgen.ref_Pfrozen_jy[0].copy()
 
-            self.assertEqual(orbgen.dao_jy[iconf].shape,
-                             (2, ncoef, nk, nao, njy))
-            self.assertEqual(orbgen.ref_Qfrozen_dao[iconf].shape,
-                             (2, ncoef, nk, nbands, nao))
+        # a new orbital that is numerically linearly dependent on the
+        # existing one adds nothing to the frozen subspace
+        coef_new = [[(np.array(coef_frozen[0][0]) + 1e-6 *
+                      rng.standard_normal((1, nbes[0]))).tolist(), []]]
+        orbgen._tab_frozen(merge(coef_frozen, coef_new, 2))
+        self.assertTrue(np.allclose(orbgen.ref_Pfrozen_jy[0], ref_Pfrozen_jy))
 
-        # verifies in the presence of frozen orbitals
-        coef_frozen = [[np.eye(2, 5).tolist(),
-                        np.eye(2, 5).tolist(),
-                        np.eye(1, 5).tolist()]]
-        orbgen._tab_frozen(coef_frozen)
-        orbgen._tab_deriv(coef)
+        # the basis of the frozen subspace stays orthonormal
+        B = orbgen._frozen[0]['B']
+        B_B = B.swapaxes(-1, -2).conj() @ orbgen.config[0]['jy_jy'][0] @ B
+        n = np.diagonal(B_B, axis1=-2, axis2=-1).real.round()
+        self.assertTrue(np.allclose(B_B, n[...,None] * np.eye(n.shape[-1]),
+                                    atol=1e-10))
 
-        self.assertEqual(len(orbgen.dao_jy), len(outdirs))
-        self.assertEqual(len(orbgen.ref_Qfrozen_dao), len(outdirs))
 
-        for iconf, conf in enumerate(orbgen.config):
-            ncoef = len(flatten(coef))
-            njy = _nao(conf['natom'], conf['nbes'])
-            nk = len(conf['wk'])
-            nbands = conf['ref_ref'].shape[-1]
+    def test_single_precision(self):
+        import os
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+
+        outdirs = [
+                os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-gamma/OUT.ABACUS/'),
+                os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-k/OUT.ABACUS/'),
+                ]
+        outdir_init = os.path.join(testfiles, 'Si/jy-7au/monomer-gamma/OUT.ABACUS/')
+
+        orbgen = Spillage_jy()
+        orbgen_single = Spillage_jy(precision='single')
+        for outdir in outdirs:
+            orbgen.config_add(outdir)
+            orbgen_single.config_add(outdir)
+
+        for dat, dat_single in zip(orbgen.config, orbgen_single.config):
+            for key in ['jy_jy', 'ref_jy']:
+                self.assertEqual(dat_single[key].nbytes * 2,
+                                 dat[key].nbytes)
+                self.assertTrue(np.allclose(dat_single[key], dat[key],
+                                            rtol=1e-6, atol=1e-6))
 
-            nzeta = [[len(coef_tl) for coef_tl in coef_t] for coef_t in coef]
-            nao = _nao(conf['natom'], nzeta)
+        coef_init = initgen_jy(outdir_init, [2, 2, 1], ibands='all')
+        coef_frozen = [[[coef_init[0][0]], [coef_init[1][0]]]]
+        coef = [[[coef_init[0][1]], [coef_init[1][1]], [coef_init[2][0]]]]
+
+        orbgen._tab_frozen(coef_frozen)
+        orbgen_single._tab_frozen(coef_frozen)
 
-            self.assertEqual(orbgen.dao_jy[iconf].shape,
-                             (2, ncoef, nk, nao, njy))
-            self.assertEqual(orbgen.ref_Qfrozen_dao[iconf].shape,
-                             (2, ncoef, nk, nbands, nao))
+        ibands = range(8)
+        for iconf in range(len(outdirs)):
+            spill, grad = orbgen._generalized_spillage(iconf, coef, ibands,
+                                                       True)
+            for full_precision in [False, True]:
+                spill_single, grad_single = \
+                        orbgen_single._generalized_spillage(
+                                iconf, coef, ibands, True, full_precision)
+                self.assertAlmostEqual(spill, spill_single, places=5)
+                self.assertTrue(np.allclose(flatten(grad), flatten(grad_single),
+                                            atol=1e-5))
+
+        # final (bounded) refinement in double precision
+        options = {'ftol': 0, 'gtol': 1e-6, 'maxiter': 300,
+                   'disp': False, 'maxcor': 20}
+        coef_opt = orbgen.opt(coef, coef_frozen, 'all', ibands, options)
+        coef_opt_single = orbgen_single.opt(coef, coef_frozen, 'all', ibands,
+                                            options)
+        spill_opt = [orbgen._generalized_spillage(iconf, c, ibands)
+                     for c in [coef_opt, coef_opt_single]
+                     for iconf in range(len(outdirs))]
+        self.assertTrue(np.allclose(spill_opt[:2], spill_opt[2:],
+                                    rtol=0, atol=1e-7))
 
 
     def test_overlap_spillage_gamma(self):
@@ -1164,6 +1910,11 @@ class _TestSpillage(unittest.TestCase):
         orbgen = Spillage_jy()
         orbgen.config_add(outdir, (0.0, 1.0))
 
+        # multi-k configuration with complex matrix elements
+        orbgen.config_add(os.path.join(testfiles,
+                                       'Si/jy-7au/monomer-k/OUT.ABACUS/'),
+                          (0.0, 1.0))
+
         nbes_data = read_running_scf_log(outdir + 'running_scf.log')['nzeta']
 
         nzeta = [2, 2, 1]
@@ -1177,30 +1928,101 @@ class _TestSpillage(unittest.TestCase):
                        for nbes_t in nbes_data]
 
         orbgen._tab_frozen(coef_frozen)
-        orbgen._tab_deriv(coef)
-
-        dspill = orbgen._generalized_spillage(0, coef, ibands, True)[1]
-        dspill = np.array(flatten(dspill))
 
         pat = nestpat(coef)
         sz = len(flatten(coef))
 
-        dspill_fd = np.zeros(sz)
-        dc = 1e-6
-        for i in range(sz):
-            coef_p = flatten(deepcopy(coef))
-            coef_p[i] += dc
-            coef_p = nest(coef_p, pat)
-            spill_p = orbgen._generalized_spillage(0, coef_p, ibands)
+        for iconf in range(len(orbgen.config)):
+            dspill = orbgen._generalized_spillage(iconf, coef, ibands, True)[1]
+            dspill = np.array(flatten(dspill))
+
+            dspill_fd = np.zeros(sz)
+            dc = 1e-6
+            for i in range(sz):
+                coef_p = flatten(deepcopy(coef))
+                coef_p[i] += dc
+                coef_p = nest(coef_p, pat)
+                spill_p = orbgen._generalized_spillage(iconf, coef_p, ibands)
 
-            coef_m = flatten(deepcopy(coef))
-            coef_m[i] -= dc
-            coef_m = nest(coef_m, pat)
-            spill_m = orbgen._generalized_spillage(0, coef_m, ibands)
+                coef_m = flatten(deepcopy(coef))
+                coef_m[i] -= dc
+                coef_m = nest(coef_m, pat)
+                spill_m = orbgen._generalized_spillage(iconf, coef_m, ibands)
 
-            dspill_fd[i] = (spill_p - spill_m) / (2 * dc)
+                dspill_fd[i] = (spill_p - spill_m) / (2 * dc)
 
-        self.assertTrue(np.allclose(dspill, dspill_fd, atol=1e-7))
+            self.assertTrue(np.allclose(dspill, dspill_fd, atol=1e-7))
+
+
+    def test_band_window_compress(self):
+        '''
+        Checks that the compressed band window leaves the spillage
+        and its gradient unchanged.
+
+        '''
+        nbes = [[4, 3]]
+        njy = 4 + 3 * 3
+        nk, nbands = 2, 20
+
+        rng = np.random.default_rng(0)
+        crandn = lambda *shape: rng.standard_normal(shape) \
+                + 1j * rng.standard_normal(shape)
+
+        A = crandn(2, nk, njy, njy)
+        jy_jy = A @ A.transpose((0,1,3,2)).conj()
+        ref_jy = crandn(2, nk, nbands, njy)
+
+        orbgen = Spillage()
+        orbgen.config = [{'natom': [2], 'nbes': nbes,
+                          'jy_jy': np.kron(np.eye(2), jy_jy),
+                          'ref_jy': np.concatenate([ref_jy, ref_jy], axis=3),
+                          'ref_ref': rng.random((2, nk, nbands)),
+                          'wk': np.array([0.25, 0.75])}]
+
+        orbgen._tab_frozen([[rng.standard_normal((1, 4)).tolist()]])
+
+        coef = [[rng.standard_normal((2, 4)).tolist(),
+                 rng.standard_normal((1, 3)).tolist()]]
+
+        for ibands in ['all', range(3, 17)]:
+            window = orbgen._band_window(0, ibands, compress=False)
+            window_c = orbgen._band_window(0, ibands, compress=True)
+
+            # the two atoms share the same <ref|jy>, and one direction is
+            # projected out by the frozen orbital
+            self.assertEqual(window_c['ref_Qfrozen_jy'].shape[2],
+                             min(window['nbands'], njy - 1))
+
+            spill, grad = orbgen._generalized_spillage(0, coef, window, True)
+            spill_c, grad_c = orbgen._generalized_spillage(0, coef, window_c,
+                                                           True)
+            self.assertAlmostEqual(spill, spill_c, places=10)
+            self.assertTrue(np.allclose(flatten(grad), flatten(grad_c),
+                                        atol=1e-10))
+
+
+    def test_band_slice(self):
+        self.assertEqual(_band_slice(range(3, 10)), slice(3, 10, 1))
+        self.assertEqual(_band_slice(range(3, 10, 2)), slice(3, 10, 2))
+        self.assertEqual(_band_slice((2, 4, 6)), slice(2, 7, 2))
+        self.assertEqual(_band_slice([5]), slice(5, 6, 1))
+        self.assertEqual(_band_slice(range(0)), slice(0, 0))
+        self.assertEqual(_band_slice([1, 2, 4]), [1, 2, 4])
+        self.assertEqual(_band_slice(range(5, 0, -1)), [5, 4, 3, 2, 1])
+
+        x = np.arange(10)
+        for ibands in [range(3, 10), range(3, 10, 2), (2, 4, 6), [1, 2, 4]]:
+            self.assertEqual(x[_band_slice(ibands)].tolist(), list(ibands))
+
+        # without frozen orbitals, the (uncompressed) window is a view
+        orbgen = Spillage()
+        orbgen.config = [{'ref_jy': np.random.randn(2, 1, 8, 5),
+                          'ref_ref': np.random.randn(2, 1, 8),
+                          'wk': np.ones(1)}]
+        window = orbgen._band_window(0, range(2, 6))
+        self.assertEqual(window['nbands'], 4)
+        self.assertTrue(np.shares_memory(window['ref_Qfrozen_jy'],
+                                         orbgen.config[0]['ref_jy']))
 
 
     def test_jy_opt(self):
@@ -1281,6 +2103,74 @@ class _TestSpillage(unittest.TestCase):
         plt.show()
 
 
+    def test_jy_opt_process(self):
+        '''
+        Checks that the process backend of opt agrees with the thread one.
+
+        '''
+        import os
+        here = os.path.dirname(os.path.abspath(__file__))
+        testfiles = os.path.join(here, 'testfiles')
+
+        outdirs = [
+                os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-gamma/OUT.ABACUS/'),
+                os.path.join(testfiles, 'Si/jy-7au/dimer-1.8-k/OUT.ABACUS/'),
+                ]
+        outdir_init = os.path.join(testfiles, 'Si/jy-7au/monomer-gamma/OUT.ABACUS/')
+
+        orbgen = Spillage_jy()
+        for outdir in outdirs:
+            orbgen.config_add(outdir)
+
+        coef_init = initgen_jy(outdir_init, [2, 2, 1], ibands='all')
+        coef_frozen = [[[coef_init[0][0]], [coef_init[1][0]]]]
+        coef_init = [[[coef_init[0][1]], [coef_init[1][1]], [coef_init[2][0]]]]
+
+        options = {'ftol': 0, 'gtol': 1e-6, 'maxiter': 10,
+                   'disp': False, 'maxcor': 20}
+        ibands = [range(8), range(6)]
+
+        coef_thread = orbgen.opt(coef_init, coef_frozen, 'all', ibands,
+                                 options, 2, backend='thread')
+        coef_process = orbgen.opt(coef_init, coef_frozen, 'all', ibands,
+                                  options, 2, backend='process')
+
+        self.assertTrue(np.allclose(flatten(coef_thread),
+                                    flatten(coef_process)))
+
+        # the available cores are split among the workers
+        windows = [orbgen._band_window(i, ibands[i]) for i in range(2)]
+        pool, shms = orbgen._process_pool(2, windows)
+        try:
+            for key in _BLAS_ENV:
+                self.assertEqual(pool.apply(os.getenv, (key,)),
+                                 str(_blas_nthreads(2)))
+        finally:
+            pool.close()
+            pool.join()
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+
+    def test_spawn_pool(self):
+        import os
+        env = {key: os.environ.get(key) for key in _BLAS_ENV}
+
+        pool = _spawn_pool(2, 1, _limit_blas, (1,))
+        try:
+            # BLAS of the workers is limited to the given number of threads
+            for key in _BLAS_ENV:
+                self.assertEqual(pool.apply(os.getenv, (key,)), '1')
+        finally:
+            pool.close()
+            pool.join()
+
+        # while the environment of this process is left intact
+        self.assertEqual({key: os.environ.get(key) for key in _BLAS_ENV},
+                         env)
+
+
     def test_pw_config_add_gamma(self):
         import os
         here = os.path.dirname(os.path.abspath(__file__))